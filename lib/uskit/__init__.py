@@ -2,6 +2,7 @@ from .query import Query
 from .query import query
 from .server import server
 from .service import service
+from .workers import workers
 from .database import database
 from .txn_service import txn_service
 from .query_service import query_service
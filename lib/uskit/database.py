@@ -1,25 +1,80 @@
 import os
+import re
 import csv
 import json
 import asyncio
+import itertools
+import contextlib
+import collections.abc
 import aiosqlite
 from . import util
 from . import debug
 from . import errors
 from . import event_manager
 from . import dynamic_record
+from .workers import Peers
+
+
+##############################################################################
+# GLOBALS
+
+REPORTED_PRAGMAS = [
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+    "busy_timeout",
+]
+
+# The most parameters SQLite binds to one statement by default.  Any version of
+# SQLite that supports RETURNING has at least this limit.
+MAX_VARIABLES = 32766
 
 
 ##############################################################################
 # DATABASE
 
 class Database:
-    def __init__(self):
+    """
+        A SQLite database whose changes can be observed.
+
+        - `groupCommitMs`, `groupCommitSize`: commit concurrent standalone
+          writes together; each completes once its group is committed.
+        - `readers`: read-only connections (WAL mode) for selects; pass
+          `writer=True` to select() to see uncommitted changes.
+        - `fetchSize`: rows fetched at a time by a select.
+        - `recordCacheSize`: records found by get() that are cached.
+        - `changeLogSize`: changes kept in `changeLog`.
+
+        Events: "{op}|{table}" and "pre{op}|{table}" per record,
+        "prebatch|{table}" and "batch|{table}" per transact(), and
+        "rollback|{table}" and "reload|{table}".  Changes are numbered by
+        "seq", comparable only within one `logId`.  The "pragmas" config
+        section tunes SQLite.
+    """
+
+    def __init__(self, groupCommitMs=0, groupCommitSize=100, readers=0, fetchSize=1000, recordCacheSize=1024, changeLogSize=10000):
         self.cfg = {}
         self.dbconn = None
+        self.dbfile = None
+        self.peers = None
+        self.fetchSize = fetchSize
+        self.readers = readers
+        self.readconns = []
+        self.readIndex = 0
         self.eventManager = event_manager.event_manager()
-        self.dynamicRecordManager = dynamic_record.DynamicRecordManager(self)
+        self.dynamicRecordManager = dynamic_record.DynamicRecordManager(self, recordCacheSize)
         self.txnId = 0
+        self.seq = 0
+        self.changeLog = util.ChangeLog(changeLogSize)
+        self.logId = os.urandom(4).hex()
+        self.groupCommitWindow = groupCommitMs / 1000
+        self.groupCommitSize = groupCommitSize
+        self.groupCommitFutures = []
+        self.groupCommitTask = None
+        self.groupCommitFull = asyncio.Event()
+        self.writeLock = asyncio.Lock()
 
         # Open the default config
         with open(os.path.join(util.MODULEDIR, "database.json")) as fd:
@@ -31,12 +86,16 @@ class Database:
     def on(self, op, table, handler):
         self.eventManager.on(f"{op}|{table}", handler)
 
+    def off(self, op, table, handler):
+        self.eventManager.off(f"{op}|{table}", handler)
+
     async def open(self, dbfile=None, cfg={}):
-        self.dbconn = await aiosqlite.connect(dbfile or ":memory:")
+        self.dbconn = await self.__connect(dbfile or ":memory:")
+        self.dbfile = dbfile
         util.dictmerge(self.cfg, cfg)
 
-        # Use the Row class as the row factory
-        self.dbconn.row_factory = aiosqlite.Row
+        # Tune SQLite before anything is written
+        await self.__pragma(self.dbconn, self.pragmas())
 
         # Add default fields to every table
         for field in self.cfg["defaultFields"]:
@@ -59,172 +118,660 @@ class Database:
 
             # Create indexes for this table, if any
             for index in self.cfg.get("indexesByTable",{}).get(table, []):
-                fields = self.cfg["fieldsByIndex"][index]
+                await self.create_index(table, index, self.cfg["fieldsByIndex"][index])
+
+        # Read connections
+        if self.readers:
+            await self.__open_readers(dbfile)
+
+    async def create_index(self, table, index, fields):
+        """
+            Create an index on a table, if it does not exist, and add it to the
+            config.
+        """
+        await self.dbconn.execute(f"""
+            create index if not exists {index} on {table} (
+                { ", ".join(fields) }
+            )
+        """)
+
+        indexes = self.cfg.setdefault("indexesByTable", {}).setdefault(table, [])
+
+        if index not in indexes:
+            indexes += [index]
+
+        self.cfg.setdefault("fieldsByIndex", {})[index] = list(fields)
+
+    async def indexes(self, table):
+        """
+            Return the list of fields of each index on a table, including the
+            primary key.
+        """
+        indexes = [self.keyfields(table)]
+
+        async with self.dbconn.execute(f"pragma index_list({table})") as cursor:
+            names = [row[1] async for row in cursor]
+
+        for name in names:
+            async with self.dbconn.execute(f"pragma index_info({name})") as cursor:
+                indexes += [[row[2] async for row in cursor]]
 
-                await self.dbconn.execute(f"""
-                    create index if not exists {index} on {table} (
-                        { ", ".join(fields) }
-                    )
-                """)
+        return indexes
+
+    async def explain(self, sqlstmt, args=[]):
+        """
+            Return the query plan of a select, as the list of the details of
+            each step of the plan.  Like select(), `sqlstmt` does not include
+            the leading "select".
+        """
+        sqlstmt = f"explain query plan select {sqlstmt}"
+
+        try:
+            async with self.dbconn.execute(sqlstmt, args) as cursor:
+                return [row[3] async for row in cursor]
+
+        except aiosqlite.Error as e:
+            debug.error("Database.explain()", str(e), sqlstmt, args)
+
+            raise errors.DatabaseError(str(e))
+
+    def record_cache_stats(self):
+        """
+            Return the size, hits, misses, and hit rate of the cache of records
+            found by get().
+        """
+        return self.dynamicRecordManager.recordCache.stats()
+
+    def pragmas(self):
+        """
+            Return the pragmas set by the config, with the preset expanded.
+        """
+        pragmas = self.cfg.get("pragmas", {}).copy()
+        preset = pragmas.pop("preset", None)
+
+        if preset is not None:
+            if preset not in self.cfg["pragmaPresets"]:
+                raise errors.DatabaseProgrammingError(f"{preset}: Invalid pragma preset")
+
+            pragmas = self.cfg["pragmaPresets"][preset] | pragmas
+
+        return pragmas
+
+    async def __pragma(self, dbconn, pragmas, isReader=False):
+        """
+            Set the pragmas on a connection.  The values in effect on the
+            writer are reported.
+        """
+        settings = []
+
+        for name, value in pragmas.items():
+            if not re.match(r"^\w+$", name) or not re.match(r"^-?\w+$", str(value)):
+                raise errors.DatabaseProgrammingError(f"{name}={value}: Invalid pragma")
+
+            # The writer decides the journal mode
+            if isReader and name in ("journal_mode", "synchronous"):
+                continue
+
+            await dbconn.execute(f"pragma {name}={value}")
+
+        if not isReader:
+            for name in dict.fromkeys(REPORTED_PRAGMAS + list(pragmas.keys())):
+                async with dbconn.execute(f"pragma {name}") as cursor:
+                    row = await cursor.fetchone()
+
+                if row:
+                    settings += [f"{name}={row[0]}"]
+
+            debug.info(f"Database pragmas {', '.join(settings)}")
+
+    async def __connect(self, dbfile, **kwargs):
+        dbconn = await aiosqlite.connect(dbfile, **kwargs)
+
+        # Rows are tuples; select() wraps them in Row
+        dbconn.row_factory = None
+
+        return dbconn
+
+    async def __open_readers(self, dbfile):
+        """
+            Switch the database to WAL mode and open the read connections.
+        """
+        if not dbfile or dbfile == ":memory:":
+            debug.warning("Database in memory cannot have read connections")
+            return
+
+        async with self.dbconn.execute("pragma journal_mode=wal") as cursor:
+            mode = (await cursor.fetchone())[0]
+
+        if mode != "wal":
+            debug.warning(f"Database journal mode is {mode}, not using read connections")
+            return
+
+        for i in range(self.readers):
+            readconn = await self.__connect(f"file:{os.path.abspath(dbfile)}?mode=ro", uri=True)
+
+            await self.__pragma(readconn, self.pragmas(), isReader=True)
+            self.readconns += [readconn]
+
+        debug.info(f"Database in WAL mode with {len(self.readconns)} read connections")
+
+    def share(self, peers):
+        """
+            Share this database file with the other workers on `peers`.
+            Their changes trigger this database's post and "batch" events,
+            marked "remote", with the record before each change as "old".
+        """
+        self.peers = peers
+        self.peerType = f"changes|{os.path.abspath(self.dbfile)}"
+        self.peers.on(self.peerType, self.__on_peer_changes)
 
     async def close(self):
+        if self.peers:
+            self.peers.off(self.peerType, self.__on_peer_changes)
+            self.peers = None
+
+        for readconn in self.readconns:
+            await readconn.close()
+
         if self.dbconn:
+            async with self.writeLock:
+                await self.__commit_group()
+
             await self.dbconn.close()
 
+        self.readconns = []
         self.dbconn = None
 
     async def get(self, table, record):
         """
             Return a dynamic record that exactly matches a keyset.  The
             returned record is dynamic; that is, the values in the record are
-            updated whenever the database is updated.
+            updated whenever the database is updated.  Records found by their
+            key fields are cached.
 
             @param table   The name of the table in which to search for the record.
             @param record  Dictionary containing the keyset.
             @returns       Found dynamic record.
         """
+        isKeyed = sorted(record.keys()) == sorted(self.keyfields(table))
 
-        names = record.keys()
-        values = record.values()
-        conditions = [f"{n}=?" for n in names]
-        found = {}
+        if isKeyed:
+            cached = self.dynamicRecordManager.cached(table, record)
 
-        async for found in self.select(f"""
-                * from {table} where {
-                    " and ".join(conditions)
-                }
-            """, list(values)):
+            if cached is not None:
+                return cached
 
+            version = self.dynamicRecordManager.observe(table)
+            isWriting = self.writeLock.locked()
+
+        sqlstmt = self.__compile("get", table, tuple(record.keys()))
+        batches = self.select_batches(sqlstmt, list(record.values()), fetchSize=1)
+        found = {}
+
+        async for (found,) in batches:
             break
 
-        return await self.dynamicRecordManager.create(table, found)
+        # Close the cursor now rather than whenever the generator is collected
+        await batches.aclose()
+
+        dynamicRecord = await self.dynamicRecordManager.create(table, found)
+
+        # Unless the record may have changed while it was being selected
+        if isKeyed and found and version == self.dynamicRecordManager.version:
+            if not self.readconns or not (isWriting or self.writeLock.locked()):
+                self.dynamicRecordManager.cache(table, dynamicRecord)
+
+        return dynamicRecord
+
+    async def select(self, sqlstmt, args=[], writer=False, fetchSize=None):
+        """
+            Select rows, each as a read-only Row.  The select runs on a read
+            connection, if there are any, unless `writer` is True.
+        """
+        async for rows in self.select_batches(sqlstmt, args, writer, fetchSize):
+            for row in rows:
+                yield row
+
+    async def select_batches(self, sqlstmt, args=[], writer=False, fetchSize=None):
+        """
+            Select rows in batches, each a list of up to `fetchSize` Rows
+            (default `Database.fetchSize`).  Rows are fetched from SQLite one
+            batch at a time.
+        """
+        fetchSize = fetchSize or self.fetchSize
+        dbconn = self.dbconn
+
+        if self.readconns and not writer:
+            dbconn = self.readconns[self.readIndex]
+            self.readIndex = (self.readIndex + 1) % len(self.readconns)
 
-    async def select(self, sqlstmt, args=[]):
         try:
-            async with self.dbconn.execute(f"select {sqlstmt}", args) as cursor:
-                async for row in cursor:
-                    rowAsDict = {}
+            async with dbconn.execute(f"select {sqlstmt}", args) as cursor:
+                columns = Row.columns_of(cursor)
 
-                    for name in row.keys():
-                        rowAsDict[name] = row[name]
+                while True:
+                    batch = await cursor.fetchmany(fetchSize)
 
-                    yield rowAsDict
+                    if not batch:
+                        break
+
+                    yield [Row(columns, values) for values in batch]
 
         except aiosqlite.Error as e:
-            debug.error(f"Database.select()", f"{str(e)}", sqlstmt, args)
+            debug.error("Database.select()", str(e), sqlstmt, args)
 
             raise errors.DatabaseError(str(e))
 
     async def transact(self, txns):
+        """
+            Run a list of inserts, updates, and deletes in one transaction.
+            Return a list of whether each changed a record.  Consecutive
+            operations with the same table and fields are run as a batch.
+        """
         reply = []
+        requestsByTable = {}
+        changesByTable = {}
 
-        await self.dbconn.execute("begin transaction")
+        for t in txns:
+            if t["table"] not in requestsByTable:
+                requestsByTable[t["table"]] = []
+                changesByTable[t["table"]] = []
 
-        try:
-            for t in txns:
-                table = t["table"]
-                record = t["record"]
-                operation = t["operation"]
+            requestsByTable[t["table"]] += [{
+                "operation" : t["operation"],
+                "record"    : t["record"],
+            }]
+
+        self.txnId += 1
+        batchId = self.txnId
+
+        async with self.__transaction(changesByTable, batchId):
+            await self.__trigger_batch("prebatch", batchId, requestsByTable)
+
+            for (operation, table, names), batch in itertools.groupby(txns, self.__shape):
+                records = [t["record"] for t in batch]
+                changes = changesByTable[table]
 
-                if   operation == "insert" : reply += [await self.insert(table, record, commit=False)]
-                elif operation == "update" : reply += [await self.update(table, record, commit=False)]
-                elif operation == "delete" : reply += [await self.delete(table, record, commit=False)]
-                else                       : raise errors.DatabaseError(f"{operation}: Invalid operation")
+                if len(records) > 1 and operation in ("insert", "update", "delete"):
+                    reply += await self.__operatemany(operation, table, names, records, batchId=batchId, changes=changes)
+                    continue
 
-            await self.dbconn.execute("commit transaction")
+                for record in records:
+                    if   operation == "insert" : reply += [await self.insert(table, record, commit=False, batchId=batchId, changes=changes)]
+                    elif operation == "update" : reply += [await self.update(table, record, commit=False, batchId=batchId, changes=changes)]
+                    elif operation == "delete" : reply += [await self.delete(table, record, commit=False, batchId=batchId, changes=changes)]
+                    else                       : raise errors.DatabaseError(f"{operation}: Invalid operation")
 
-        except Exception as e:
-            await self.dbconn.execute("rollback transaction")
-            raise e
+            await self.__trigger_batch("batch", batchId, changesByTable, seq=self.__last_seq(changesByTable))
+
+        await self.__publish({
+            "changesByTable" : { table : changes for table, changes in changesByTable.items() if changes },
+        })
 
         return reply
 
-    async def insert(self, table, record, **kwargs):
-        record = record.copy()
-        record["TIMESTAMP"] = util.nowstring()
+    async def __trigger_batch(self, operation, batchId, changesByTable, **kwargs):
+        for table in changesByTable.keys():
+            await self.eventManager.trigger({
+                "type"           : f"{operation}|{table}",
+                "operation"      : operation,
+                "table"          : table,
+                "changesByTable" : changesByTable,
+                "txnId"          : batchId,
+                **kwargs,
+            })
+
+    async def __trigger_change(self, event):
+        """
+            Number a change that has been made, log it, and trigger its
+            event.  Return its number.
+        """
+        self.seq += 1
+        seq = event["seq"] = self.seq
 
-        names = record.keys()
-        values = record.values()
-        qmarks = ["?"] * len(record)
+        self.changeLog.append(seq, {
+            "operation" : event["operation"],
+            "table"     : event["table"],
+            "rowId"     : event.get("rowId"),
+        })
+
+        await self.eventManager.trigger(event)
+
+        return seq
+
+    @staticmethod
+    def __last_seq(changesByTable):
+        return max((change["seq"] for changes in changesByTable.values() for change in changes), default=None)
+
+    async def __publish(self, message):
+        """
+            Send the "changesByTable" and the tables to "reload" of a message
+            to the other workers, if the database is shared.  Changes too
+            large for one message are split across several, and the table of
+            a change too large by itself is reloaded instead.
+        """
+        if not self.peers or not (message.get("changesByTable") or message.get("reload")):
+            return
+
+        data = self.peers.encode({ "type" : self.peerType, **message })
+
+        if data is not None:
+            await self.peers.send(data)
+            return
+
+        changes = [(table, change) for table, changes in message.get("changesByTable", {}).items() for change in changes]
+        half = len(changes) // 2
+
+        if len(changes) == 0:
+            debug.error("Database.__publish()", "Message too large to send to the other workers", message.get("reload"))
+            return
+
+        if len(changes) == 1:
+            await self.__publish({ "reload" : message.get("reload", []) + [changes[0][0]] })
+            return
+
+        for part in [changes[:half], changes[half:]]:
+            changesByTable = {}
+
+            for table, change in part:
+                changesByTable[table] = changesByTable.get(table, []) + [change]
+
+            await self.__publish({ "changesByTable" : changesByTable })
+
+        await self.__publish({ "reload" : message.get("reload", []) })
+
+    async def __on_peer_changes(self, event):
+        """
+            Trigger the events of the changes committed by another worker.
+        """
+        for table in event.get("reload", []):
+            await self.__trigger_change({
+                "type"      : f"reload|{table}",
+                "operation" : "reload",
+                "table"     : table,
+                "remote"    : True,
+            })
+
+        changesByTable = event.get("changesByTable", {})
+
+        if not changesByTable:
+            return
+
+        self.txnId += 1
+        batchId = self.txnId
+
+        for table, changes in changesByTable.items():
+            for change in changes:
+                self.txnId += 1
+
+                change["seq"] = await self.__trigger_change({
+                    "type"      : f"{change['operation']}|{table}",
+                    "operation" : change["operation"],
+                    "table"     : table,
+                    "record"    : change["record"],
+                    "txnId"     : self.txnId,
+                    "rowId"     : change["rowId"],
+                    "batchId"   : batchId,
+                    "remote"    : True,
+                })
+
+        await self.__trigger_batch("batch", batchId, changesByTable, seq=self.__last_seq(changesByTable), remote=True)
+
+    @staticmethod
+    def __shape(txn):
+        return (txn["operation"], txn["table"], tuple(txn["record"].keys()))
+
+    async def load(self, *filenames, chunkSize=10000, events=True):
+        """
+            Bulk load CSV data files, in parallel, `chunkSize` lines per
+            transaction.  If `events` is False, a "reload" event is triggered
+            per table instead of per-record events.
+        """
+        await asyncio.gather(*[self.__load(f, chunkSize, events) for f in filenames])
+
+    async def __load(self, filename, chunkSize, events):
+        debug.info(f"Loading into database: {filename}")
+        chunks = csvchunks(filename, chunkSize)
+        tables = []
+        count = 0
+
+        try:
+            while True:
+                # Parse the next chunk while other files are being inserted
+                chunk = await asyncio.to_thread(next, chunks, None)
+
+                if chunk is None:
+                    break
+
+                self.txnId += 1
+                changesByTable = { table : [] for table, names in chunk.keys() }
+
+                async with self.__transaction(changesByTable, self.txnId):
+                    for (table, names), rows in chunk.items():
+                        if events:
+                            for row in rows:
+                                await self.insert(table, dict(zip(names, row)), commit=False, changes=changesByTable[table])
+                        else:
+                            await self.__insertmany(table, names, rows)
+
+                        count += len(rows)
+
+                # The chunk has been committed
+                tables += [table for table in changesByTable if table not in tables]
+
+        finally:
+            chunks.close()
+
+            # Let observers know the tables have been loaded, even if only in
+            # part because a later chunk failed
+            if not events:
+                for table in tables:
+                    await self.__trigger_change({
+                        "type"      : f"reload|{table}",
+                        "operation" : "reload",
+                        "table"     : table,
+                    })
+
+            if tables:
+                await self.__publish({ "reload" : tables })
+
+        debug.info(f"Loaded {count} records from {filename}")
+
+    async def __insertmany(self, table, names, rows):
+        names = list(names)
+        timestamp = []
+
+        # Timestamped like insert(), replacing any TIMESTAMP in the file
+        if "TIMESTAMP" in self.cfg["fieldsByTable"][table]:
+            if "TIMESTAMP" in names:
+                index = names.index("TIMESTAMP")
+                names = names[:index] + names[index+1:]
+                rows = [row[:index] + row[index+1:] for row in rows]
+
+            names += ["TIMESTAMP"]
+            timestamp = [util.nowstring()]
 
         sqlstmt = f"""
             insert into {table} (
                 { ", ".join(names) }
             )
             values (
-                { ", ".join(qmarks) }
+                { ", ".join(["?"] * len(names)) }
             )
-            returning rowid as "__rowid__", *;
         """
 
-        return await self.__operate("insert", table, record, sqlstmt, list(values), **kwargs)
+        debug.database(sqlstmt, f"({len(rows)} records)")
+
+        try:
+            await self.dbconn.executemany(sqlstmt, [list(row) + timestamp for row in rows])
+
+        except aiosqlite.IntegrityError as e:
+            raise errors.DatabaseIntegrityError(str(e))
+
+        except aiosqlite.Error as e:
+            debug.error("Database.load()", str(e), sqlstmt)
+            raise errors.DatabaseError(str(e))
+
+    @contextlib.asynccontextmanager
+    async def __transaction(self, changesByTable, txnId):
+        """
+            Run the writes in the block in one transaction, committed if the
+            block completes and rolled back if it raises.  The block adds the
+            changes whose events it has triggered to `changesByTable`; on
+            rollback, a "rollback" event is triggered for each of its tables
+            with all of them.
+        """
+        async with self.writeLock:
+            # Writes waiting on a group commit are not part of this transaction
+            await self.__commit_group()
+
+            # Take the write lock up front, so no other process sharing the
+            # database can commit between the reads and writes of this one
+            await self.dbconn.execute("begin immediate transaction")
+
+            try:
+                yield
+                await self.dbconn.execute("commit transaction")
+
+            except Exception as e:
+                await self.dbconn.execute("rollback transaction")
+                self.dynamicRecordManager.forget()
+
+                for table in changesByTable.keys():
+                    await self.__trigger_change({
+                        "type"           : f"rollback|{table}",
+                        "operation"      : "rollback",
+                        "table"          : table,
+                        "changesByTable" : changesByTable,
+                        "txnId"          : txnId,
+                    })
+
+                raise e
+
+    async def insert(self, table, record, **kwargs):
+        record = record.copy()
+        record["TIMESTAMP"] = util.nowstring()
+        sqlstmt = self.__compile("insert", table, tuple(record.keys()))
+
+        return await self.__operate("insert", table, record, sqlstmt, list(record.values()), **kwargs)
 
     async def update(self, table, record, **kwargs):
         record = record.copy()
         record["TIMESTAMP"] = util.nowstring()
+        sqlstmt = self.__compile("update", table, tuple(record.keys()))
+        keyvalues = [record[kn] for kn in self.cfg["keyfieldsByTable"][table]]
 
-        names = record.keys()
-        values = record.values()
-        statements = [f"{n}=?" for n in names]
+        return await self.__operate("update", table, record, sqlstmt, list(record.values()) + keyvalues, **kwargs)
 
-        keynames = self.cfg["keyfieldsByTable"][table]
-        keyvalues = [record[kn] for kn in keynames]
-        conditions = [f"{n}=?" for n in keynames]
+    async def delete(self, table, record, **kwargs):
+        sqlstmt = self.__compile("delete", table, tuple(record.keys()))
 
-        sqlstmt = f"""
-            update {table} set {
-                ", ".join(statements)
-            }
-            where {
-                " and ".join(conditions)
-            }
-            returning rowid as "__rowid__", *;
+        return await self.__operate("delete", table, record, sqlstmt, list(record.values()), **kwargs)
+
+    def __compile(self, operation, table, names, count=None):
+        """
+            Return the SQL statement of an operation on a table with a set of
+            fields.  If `count` is given, the statement writes that many
+            records at once, their values given one record after another in
+            the order of `names`.
         """
+        if operation == "insert":
+            values = "(" + ", ".join(["?"] * len(names)) + ")"
 
-        return await self.__operate("update", table, record, sqlstmt, list(values) + list(keyvalues), **kwargs)
+            return f"""
+                insert into {table} (
+                    { ", ".join(names) }
+                )
+                values
+                    { ", ".join([values] * (count or 1)) }
+                returning rowid as "__rowid__", *;
+            """
+
+        if operation == "update" and count:
+            keynames = self.cfg["keyfieldsByTable"][table]
+            values = "(" + ", ".join(["?"] * len(names)) + ")"
+
+            # Each record's values, matched to its record by the key fields
+            return f"""
+                update {table} set {
+                    ", ".join(f"{n}=v.column{i+1}" for i, n in enumerate(names))
+                }
+                from (values { ", ".join([values] * count) }) as v
+                where {
+                    " and ".join(f"{table}.{n}=v.column{names.index(n)+1}" for n in keynames)
+                }
+                returning rowid as "__rowid__", *;
+            """
 
-    async def delete(self, table, record, **kwargs):
-        names = record.keys()
-        values = record.values()
-        conditions = [f"{n}=?" for n in names]
+        if operation == "delete" and count:
+            values = "(" + ", ".join(["?"] * len(names)) + ")"
 
-        sqlstmt = f"""
-            delete from {table} where {
-                " and ".join(conditions)
-            }
-            returning rowid as "__rowid__", *;
-        """
+            return f"""
+                delete from {table} where ({ ", ".join(names) }) in (
+                    values { ", ".join([values] * count) }
+                )
+                returning rowid as "__rowid__", *;
+            """
+
+        if operation == "update":
+            keynames = self.cfg["keyfieldsByTable"][table]
+
+            return f"""
+                update {table} set {
+                    ", ".join(f"{n}=?" for n in names)
+                }
+                where {
+                    " and ".join(f"{n}=?" for n in keynames)
+                }
+                returning rowid as "__rowid__", *;
+            """
 
-        return await self.__operate("delete", table, record, sqlstmt, list(values), **kwargs)
+        if operation == "delete":
+            return f"""
+                delete from {table} where {
+                    " and ".join(f"{n}=?" for n in names)
+                }
+                returning rowid as "__rowid__", *;
+            """
+
+        if operation == "get":
+            return f"""
+                * from {table} where {
+                    " and ".join(f"{n}=?" for n in names)
+                }
+            """
+
+        raise errors.DatabaseError(f"{operation}: Invalid operation")
 
     async def __operate(self, operation, table, record, sqlstmt, args, **kwargs):
+        isGroupCommit = self.groupCommitWindow and kwargs.get("commit", True)
         result = {}
-        rowid = None
+        rowId = None
         txnd = False
 
         # Pre-transaction
         self.txnId += 1
+        txnId = self.txnId
         debug.database(sqlstmt, args)
-        await self.eventManager.trigger({
-            "type"      : f"pre{operation}|{table}",
-            "operation" : f"pre{operation}",
-            "table"     : table,
-            "record"    : record,
-            "txnId"     : self.txnId,
-        })
+        await self.__trigger_pre(operation, table, record, txnId, kwargs.get("batchId"))
 
         # Transaction
         try:
-            async with await self.dbconn.execute(sqlstmt, args) as cursor:
-                async for row in cursor:
-                    for name in row.keys():
-                        if name == "__rowid__":
-                            rowId = row[name]
-                        else:
-                            result[name] = row[name]
-
-            if kwargs.get("commit", True):
-                await self.dbconn.commit()
+            if isGroupCommit:
+                async with self.writeLock:
+                    (old,) = await self.__olds(operation, table, [record])
+                    rowId = await self.__execute(sqlstmt, args, result)
+                    committed = self.__group_commit()
+
+                await committed
+            elif kwargs.get("commit", True):
+                async with self.writeLock:
+                    (old,) = await self.__olds(operation, table, [record])
+                    rowId = await self.__execute(sqlstmt, args, result)
+                    await self.dbconn.commit()
+            else:
+                (old,) = await self.__olds(operation, table, [record])
+                rowId = await self.__execute(sqlstmt, args, result)
 
         except aiosqlite.IntegrityError as e:
             raise errors.DatabaseIntegrityError(str(e))
@@ -236,35 +783,380 @@ class Database:
         except aiosqlite.Error as e:
             raise errors.DatabaseError(str(e))
 
+        # A delete returns the record as it was
+        if operation == "delete":
+            old = result
+
         # Post-transaction
         if result:
-            await self.eventManager.trigger({
-                "type"      : f"{operation}|{table}",
-                "operation" : operation,
-                "table"     : table,
-                "record"    : result,
-                "txnId"     : self.txnId,
-                "rowId"     : rowId,
-            })
+            change = await self.__trigger_post(operation, table, result, old, txnId, rowId, kwargs.get("batchId"), kwargs.get("changes"))
             txnd = True
 
+            # Writes in a transaction are sent once it commits
+            if kwargs.get("commit", True):
+                await self.__publish({
+                    "changesByTable" : { table : [change] },
+                })
+
         return txnd
 
+    async def __operatemany(self, operation, table, names, records, **kwargs):
+        """
+            Same as __operate() without committing, but for a batch of
+            records with the same fields, written with as few statements as
+            SQLite allows.  Not executemany(), which discards RETURNING rows.
+        """
+        keynames = self.cfg["keyfieldsByTable"][table]
+        results = [{} for record in records]
+        rowIds = []
+
+        if operation in ("insert", "update"):
+            timestamp = util.nowstring()
+            records = [{**record, "TIMESTAMP": timestamp} for record in records]
+            names = tuple(records[0].keys())
+
+        # Pre-transaction
+        txnIds = range(self.txnId + 1, self.txnId + len(records) + 1)
+        self.txnId += len(records)
+
+        for record, txnId in zip(records, txnIds):
+            await self.__trigger_pre(operation, table, record, txnId, kwargs.get("batchId"))
+
+        # Transaction
+        try:
+            olds = await self.__olds(operation, table, records)
+
+            if self.__is_keyed(table, records) and (operation != "delete" or sorted(names) == sorted(keynames)):
+                count = max(1, MAX_VARIABLES // len(names))
+
+                for i in range(0, len(records), count):
+                    chunk = records[i:i+count]
+                    sqlstmt = self.__compile(operation, table, names, len(chunk))
+                    args = [value for record in chunk for value in record.values()]
+                    keys = [tuple(record[kn] for kn in keynames) for record in chunk]
+
+                    debug.database(sqlstmt, f"({len(chunk)} records)")
+                    rowIds += await self.__executemany(sqlstmt, args, results[i:i+count], keynames, keys)
+            else:
+                sqlstmt = self.__compile(operation, table, names)
+
+                debug.database(sqlstmt, f"({len(records)} records)")
+
+                for i, record in enumerate(records):
+                    args = list(record.values())
+
+                    if operation == "update":
+                        args += [record[kn] for kn in keynames]
+
+                    rowIds += await self.__executemany(sqlstmt, args, results[i:i+1])
+
+        except aiosqlite.IntegrityError as e:
+            raise errors.DatabaseIntegrityError(str(e))
+
+        except aiosqlite.OperationalError as e:
+            debug.error(f"Database.{operation}()", f"{str(e)}", f"({len(records)} records)")
+            raise errors.DatabaseOperationalError(str(e))
+
+        except aiosqlite.Error as e:
+            raise errors.DatabaseError(str(e))
+
+        # A delete returns the record as it was
+        if operation == "delete":
+            olds = results
+
+        # Post-transaction
+        for result, old, txnId, rowId in zip(results, olds, txnIds, rowIds):
+            if result:
+                await self.__trigger_post(operation, table, result, old, txnId, rowId, kwargs.get("batchId"), kwargs.get("changes"))
+
+        return [bool(result) for result in results]
+
+    async def __trigger_pre(self, operation, table, record, txnId, batchId):
+        await self.eventManager.trigger({
+            "type"      : f"pre{operation}|{table}",
+            "operation" : f"pre{operation}",
+            "table"     : table,
+            "record"    : record,
+            "txnId"     : txnId,
+            "batchId"   : batchId,
+        })
+
+    async def __trigger_post(self, operation, table, result, old, txnId, rowId, batchId, changes):
+        """
+            Trigger the event of a change that has been made, and add the
+            change to `changes` unless it is None.  Return the change.
+        """
+        change = {
+            "operation" : operation,
+            "record"    : result,
+            "old"       : old,
+            "rowId"     : rowId,
+        }
+
+        change["seq"] = await self.__trigger_change({
+            "type"      : f"{operation}|{table}",
+            "operation" : operation,
+            "table"     : table,
+            "record"    : result,
+            "txnId"     : txnId,
+            "rowId"     : rowId,
+            "batchId"   : batchId,
+        })
+
+        if changes is not None:
+            changes += [change]
+
+        return change
+
+    def __is_keyed(self, table, records):
+        """
+            Return True if the records written to a table can be told apart
+            by their key fields as returned by SQLite, i.e., every record has
+            distinct key values already of the type their columns store.
+        """
+        keynames = self.cfg["keyfieldsByTable"][table]
+        keys = set()
+
+        for kn in keynames:
+            fieldType = self.cfg["typesByField"][kn].lower()
+
+            if   "int" in fieldType  : keyType = int
+            elif "char" in fieldType : keyType = str
+            elif "clob" in fieldType : keyType = str
+            elif "text" in fieldType : keyType = str
+            else                     : return False
+
+            for record in records:
+                if type(record.get(kn)) is not keyType:
+                    return False
+
+        for record in records:
+            keys.add(tuple(record[kn] for kn in keynames))
+
+        return len(keys) == len(records)
+
+    async def __olds(self, operation, table, records):
+        """
+            Return each record of an update as it was before, or None, for
+            the other workers.  Only read if the database is shared.
+        """
+        if not self.peers or operation != "update":
+            return [None] * len(records)
+
+        keynames = self.cfg["keyfieldsByTable"][table]
+        keys = [tuple(record[kn] for kn in keynames) for record in records]
+        count = max(1, MAX_VARIABLES // len(keynames))
+        oldByKey = {}
+
+        for i in range(0, len(keys), count):
+            chunk = keys[i:i+count]
+            values = "(" + ", ".join(["?"] * len(keynames)) + ")"
+            sqlstmt = f"* from {table} where ({', '.join(keynames)}) in (values {', '.join([values] * len(chunk))})"
+
+            async for row in self.select(sqlstmt, [value for key in chunk for value in key], writer=True):
+                oldByKey[tuple(row[kn] for kn in keynames)] = row.asdict()
+
+        return [oldByKey.get(key) for key in keys]
+
+    async def __executemany(self, sqlstmt, args, results, keynames=(), keys=()):
+        """
+            Execute a statement, store each returned record in its entry of
+            `results`, matched by `keys` or by order, and return the rowids.
+        """
+        rowIds = [None] * len(results)
+        indexByKey = { key : i for i, key in enumerate(keys) }
+
+        async with await self.dbconn.execute(sqlstmt, args) as cursor:
+            names = [d[0] for d in cursor.description]
+            rows = await cursor.fetchall()
+
+        if len(rows) > len(results):
+            raise errors.DatabaseError(f"Expected {len(results)} records, got {len(rows)}")
+
+        for i, row in enumerate(rows):
+            record = dict(zip(names, row))
+
+            if keys:
+                i = indexByKey.get(tuple(record[kn] for kn in keynames))
+
+                if i is None:
+                    raise errors.DatabaseError(f"Unexpected record returned: {record}")
+
+            rowIds[i] = record.pop("__rowid__")
+            results[i].update(record)
+
+        return rowIds
+
+    async def __execute(self, sqlstmt, args, result):
+        """
+            Execute a statement that returns the changed record.  Store the
+            record in `result` and return its rowid.
+        """
+        rowId = None
+
+        async with await self.dbconn.execute(sqlstmt, args) as cursor:
+            names = [d[0] for d in cursor.description]
+
+            async for row in cursor:
+                for name, value in zip(names, row):
+                    if name == "__rowid__":
+                        rowId = value
+                    else:
+                        result[name] = value
+
+        return rowId
+
+    def __group_commit(self):
+        """
+            Add the current write to the next group commit and return a future
+            that completes once the write has been committed.
+        """
+        future = asyncio.get_running_loop().create_future()
+
+        self.groupCommitFutures += [future]
+
+        if len(self.groupCommitFutures) >= self.groupCommitSize:
+            self.groupCommitFull.set()
+
+        if not self.groupCommitTask:
+            self.groupCommitTask = asyncio.create_task(self.__group_commit_later())
+
+        return future
+
+    async def __group_commit_later(self):
+        try:
+            while self.groupCommitFutures:
+                try:
+                    await asyncio.wait_for(self.groupCommitFull.wait(), self.groupCommitWindow)
+                except asyncio.TimeoutError:
+                    pass
+
+                async with self.writeLock:
+                    await self.__commit_group()
+
+        finally:
+            self.groupCommitTask = None
+
+    async def __commit_group(self):
+        """
+            Commit the writes waiting on a group commit.  The caller must hold
+            the write lock.
+        """
+        futures = self.groupCommitFutures
+
+        self.groupCommitFutures = []
+        self.groupCommitFull.clear()
+
+        if futures:
+            try:
+                await self.dbconn.commit()
+
+            except aiosqlite.Error as e:
+                debug.error("Database.__commit_group()", str(e), f"{len(futures)} writes")
+                await self.dbconn.rollback()
+                self.dynamicRecordManager.forget()
+
+                # Skip writers that gave up waiting (e.g., were cancelled)
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(errors.DatabaseError(str(e)))
+
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+
+
+##############################################################################
+# ROW
+
+class Row(collections.abc.Mapping):
+    """
+        A read-only row returned by a select.  It behaves like a dictionary,
+        but it is a tuple of values plus a mapping of column name to index
+        that is shared by every row of the same select.  Rows of the same
+        select compare by their values.
+
+        The uskit codecs encode a Row as an object.  Use `row.asdict()` for a
+        modifiable copy, e.g., to pass to json.dumps().
+    """
+    __slots__ = ("_columns", "_values")
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    @staticmethod
+    def columns_of(cursor):
+        """
+            Return the mapping of column name to index of a cursor.
+        """
+        return { d[0] : i for (i, d) in enumerate(cursor.description) }
+
+    def __getitem__(self, name):
+        return self._values[self._columns[name]]
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __eq__(self, other):
+        if isinstance(other, Row) and other._columns is self._columns:
+            return self._values == other._values
+
+        if isinstance(other, collections.abc.Mapping):
+            return self.asdict() == dict(other)
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.asdict())
+
+    def get(self, name, default=None):
+        index = self._columns.get(name)
+
+        return default if index is None else self._values[index]
+
+    def asdict(self, factory=dict):
+        """
+            Return a copy of the row as a `factory`, a dict by default.
+        """
+        return factory(zip(self._columns, self._values))
+
 
 ##############################################################################
-# CSV OPERATOR
+# CSV READER
 
-async def csvop(filename, rowHandler):
-    debug.info(f"Loading into database: {filename}")
-    header = []
+CONVERTERS = {
+    "i" : int,
+    "f" : float,
+    "s" : str,
+}
 
-    with open(filename) as fd:
-        reader = csv.reader(fd)
+def csvchunks(filename, chunkSize):
+    """
+        Read a CSV data file in chunks of up to `chunkSize` lines.  Each chunk
+        is a dictionary of (table, column names) to a list of rows, with the
+        values converted to the types given in the header.
 
-        # For each row
-        for row in reader:
-            records = {}
+        The header names each column as `table.column.type`, where type is
+        i (integer), f (float), or s (string).  An empty line means the next
+        line is a new header.
+    """
+    header = None
+    convertersByKey = {}
+    chunk = {}
+    count = 0
 
+    with open(filename, newline="") as fd:
+        for row in csv.reader(fd):
             # Empty row -> next row is a new header
             if not row:
                 header = None
@@ -272,29 +1164,52 @@ async def csvop(filename, rowHandler):
 
             # No header --> this is the header
             if not header:
-                header = row
+                header = csvheader(filename, row)
+
+                for (table, names, indexes, converters) in header:
+                    convertersByKey[(table, names)] = converters
+
                 continue
 
-            # For each column
-            for (name,value) in zip(header,row):
-                (table, colname, type) = name.split(".")
+            for (table, names, indexes, converters) in header:
+                chunk.setdefault((table, names), []).append([row[i] for i in indexes])
 
-                if table not in records:
-                    records[table] = {}
+            count += 1
 
-                if type == "i":
-                    value = int(value)
-                elif type == "f":
-                    value = float(value)
-                elif type == "s":
-                    value = str(value)
-                else:
-                    raise errors.DatabaseProgrammingError(f"{filename}: Invalid type in column {colname}")
+            if count >= chunkSize:
+                yield csvconvert(chunk, convertersByKey)
+                chunk = {}
+                count = 0
 
-                records[table][colname] = value
+    if chunk:
+        yield csvconvert(chunk, convertersByKey)
 
-            for (table,row) in records.items():
-                await rowHandler(table, row)
+def csvheader(filename, row):
+    """
+        Return a header as a list of (table, column names, column indexes,
+        converters), one per table.
+    """
+    columnsByTable = {}
+
+    for (index, name) in enumerate(row):
+        (table, colname, type) = name.split(".")
+
+        if type not in CONVERTERS:
+            raise errors.DatabaseProgrammingError(f"{filename}: Invalid type in column {colname}")
+
+        columnsByTable.setdefault(table, []).append((colname, index, CONVERTERS[type]))
+
+    return [(table, tuple(c[0] for c in columns), [c[1] for c in columns], [c[2] for c in columns]) for (table, columns) in columnsByTable.items()]
+
+def csvconvert(chunk, convertersByKey):
+    """
+        Convert the values in a chunk, one column at a time.
+    """
+    for key, rows in chunk.items():
+        columns = [map(converter, column) for (converter, column) in zip(convertersByKey[key], zip(*rows))]
+        chunk[key] = list(zip(*columns))
+
+    return chunk
 
 
 ##############################################################################
@@ -302,9 +1217,18 @@ async def csvop(filename, rowHandler):
 
 async def database(cfgfile=None, **kwargs):
     """
-        Create and return a database object.
+        Create and return a database object.  See `Database` for the
+        options.  `datafiles` are loaded into a new database by load(), with
+        `loadChunkSize` and `loadEvents`.
     """
-    db = Database()
+    db = Database(
+        kwargs.get("groupCommitMs", 0),
+        kwargs.get("groupCommitSize", 100),
+        kwargs.get("readers", 0),
+        kwargs.get("fetchSize", 1000),
+        kwargs.get("recordCacheSize", 1024),
+        kwargs.get("changeLogSize", 10000),
+    )
     dbfile = kwargs.get("dbfile")
     datafiles = kwargs.get("datafiles", [])
     dbexists = dbfile and os.path.exists(dbfile)
@@ -318,10 +1242,12 @@ async def database(cfgfile=None, **kwargs):
 
             await db.open(dbfile, cfg)
 
-    # Load CSV file for a new database
-    if not dbexists:
-        for df in datafiles:
-            await csvop(df, db.insert)
+            if dbfile and Peers.current:
+                db.share(Peers.current)
+
+    # Load CSV files for a new database
+    if not dbexists and datafiles:
+        await db.load(*datafiles, chunkSize=kwargs.get("loadChunkSize", 10000), events=kwargs.get("loadEvents", True))
 
     return db
 
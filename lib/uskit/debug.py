@@ -1,5 +1,10 @@
+import os
 import sys
-import inspect
+import json
+import queue
+import atexit
+import datetime
+import threading
 
 
 ##############################################################################
@@ -16,41 +21,169 @@ DEBUG_LEVEL = {
     "DATABASE" : False,
 };
 
+DEBUG_FORMAT = "text"
+
+
+##############################################################################
+# LAZY
+
+class Lazy:
+    """
+        A log argument that is only computed if the log level is enabled,
+        e.g. debug.socket("TX:", debug.lazy(lambda: json.dumps(message))).
+    """
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self):
+        return self.func()
+
+def lazy(func):
+    return Lazy(func)
+
+
+##############################################################################
+# LOG WRITER
+
+class LogWriter:
+    """
+        Write log records to stderr from a background thread so logging never
+        blocks the caller on I/O.  Records are written in the order they are
+        logged.
+
+        The records logged before a fork are written before it, and a forked
+        child, which does not inherit the thread, starts its own.
+    """
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, record, format="text"):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.__run, name="uskit-log", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.flush)
+
+        self.queue.put((record, format))
+
+    def after_fork(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def flush(self):
+        """
+            Wait until every record logged so far has been written.
+        """
+        if self.thread is not None:
+            done = threading.Event()
+
+            self.queue.put(done)
+            done.wait(5)
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+
+            if isinstance(item, threading.Event):
+                sys.stderr.flush()
+                item.set()
+                continue
+
+            (record, format) = item
+
+            try:
+                if format == "json":
+                    sys.stderr.write(json.dumps(record, default=str) + "\n")
+                else:
+                    self.__write_text(record)
+            except Exception:
+                pass
+
+    def __write_text(self, record):
+        color = record["color"]
+        isatty = sys.stderr.isatty()
+        text = " ".join([f"[{record['level']}]"] + record["args"])
+
+        # Color on
+        if isatty and color is not None:
+            sys.stderr.write(f"\033[1;{color}m")
+
+        sys.stderr.write(text + "\n")
+
+        # Color off
+        if isatty and color is not None:
+            sys.stderr.write("\33[0m")
+
+WRITER = LogWriter()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=WRITER.flush, after_in_child=WRITER.after_fork)
+
 
 ##############################################################################
 # FUNCTIONS
 
+def enabled(level):
+    """
+        Return True if `level` is enabled.  Use this to skip building log
+        arguments that are expensive to compute.
+    """
+    return DEBUG_LEVEL.get(level, False)
+
+def set_level(level, isEnabled=True):
+    """
+        Enable or disable a log level at runtime.
+    """
+    DEBUG_LEVEL[level] = bool(isEnabled)
+
+def set_format(format):
+    """
+        Set the log output format at runtime: "text" or "json" (one JSON
+        object per line).
+    """
+    global DEBUG_FORMAT
+
+    DEBUG_FORMAT = format
+
+def flush():
+    WRITER.flush()
+
 def log(level, *args, **kwargs):
     if DEBUG_LEVEL.get(level):
         color = kwargs.get("color")
         stack = kwargs.get("stack")
+        args = [str(arg() if isinstance(arg, Lazy) else arg) for arg in args]
 
         # Stackframe
         if stack:
-            args = list(args)
+            frame = sys._getframe(2)
             frames = []
 
-            if stack == 1 : depth = 3     # 1 depth
-            else          : depth = None  # Infinite depth
-
-            for frame in inspect.stack()[2:depth]:
-                filepath = frame[1]
-                lineno = frame[2]
-                func = frame[3]
+            while frame is not None:
+                filepath = frame.f_code.co_filename
+                lineno = frame.f_lineno
+                func = frame.f_code.co_name
                 frames += [f"at {filepath} line {lineno} in {func}()"]
+                frame = frame.f_back
+
+                if stack == 1:
+                    break
 
             if stack == 1 : args += frames
             else          : args += ["\n    ".join(frames)]
 
-        # Color on
-        if sys.stderr.isatty() and color is not None:
-            sys.stderr.write(f"\033[1;{color}m")
-
-        print(f"[{level}]", *args, file=sys.stderr)
-
-        # Color off
-        if sys.stderr.isatty() and color is not None:
-            sys.stderr.write("\33[0m")
+        WRITER.write({
+            "time"  : datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            "level" : level,
+            "color" : color,
+            "args"  : args,
+        }, DEBUG_FORMAT)
 
 def info(*args, **kwargs):
     log("INFO", *args, **kwargs)
@@ -68,11 +201,11 @@ def debug(*args, **kwargs):
     log("DEBUG", *args, color=33, stack=2, **kwargs)
 
 def event(*args, **kwargs):
-    log("EVENT", *args, color=35, stack=2, **kwargs)
+    if DEBUG_LEVEL.get("EVENT"):
+        log("EVENT", *args, color=35, stack=2, **kwargs)
 
 def socket(*args, **kwargs):
     log("SOCKET", *args, **kwargs)
 
 def database(*args, **kwargs):
     log("DATABASE", *args, **kwargs)
-
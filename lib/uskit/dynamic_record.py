@@ -1,5 +1,6 @@
 import weakref
 import asyncio
+from . import util
 from . import debug
 
 
@@ -18,10 +19,56 @@ class DynamicRecord(dict):
 # DYNAMIC RECORD MANAGER
 
 class DynamicRecordManager:
-    def __init__(self, db):
+    """
+        Besides the records referenced elsewhere, up to `cacheSize` of the
+        most recently looked up records are held in `recordCache`, keyed by
+        their table and key fields.  They are kept current by the same
+        events that update every dynamic record, so a lookup by key that
+        hits the cache needs no select.
+    """
+
+    def __init__(self, db, cacheSize=1024):
         self.db = db
         self.recordByKey = weakref.WeakValueDictionary()
+        self.recordCache = util.LruCache(cacheSize)
         self.observingTables = {}
+        self.version = 0
+
+    def observe(self, table):
+        """
+            Observe the changes to a table, if not already, and return the
+            number of changes observed so far.
+        """
+        if table not in self.observingTables:
+            self.observingTables[table] = True
+            self.db.on("insert", table, self.__on_insert)
+            self.db.on("update", table, self.__on_update)
+            self.db.on("delete", table, self.__on_delete)
+            self.db.on("reload", table, self.__on_reload)
+
+        return self.version
+
+    def cached(self, table, keyset):
+        """
+            Return the cached record of a keyset, or None if it is not cached.
+        """
+        key = tuple([table] + [keyset.get(f) for f in self.db.keyfields(table)])
+
+        return self.recordCache.get(key)
+
+    def cache(self, table, record):
+        """
+            Hold a dynamic record in the cache.
+        """
+        key = tuple([table] + [record.get(f) for f in self.db.keyfields(table)])
+
+        self.recordCache.set(key, record)
+
+    def forget(self):
+        """
+            Empty the cache, e.g., after changes it has seen were rolled back.
+        """
+        self.recordCache.clear()
 
     async def create(self, table, record):
         key = tuple([table] + [record.get(f) for f in self.db.keyfields(table)])
@@ -33,11 +80,7 @@ class DynamicRecordManager:
         """
 
         # Observe this table
-        if table not in self.observingTables:
-            self.observingTables[table] = True
-            self.db.on("insert", table, self.__on_insert)
-            self.db.on("update", table, self.__on_update)
-            self.db.on("delete", table, self.__on_delete)
+        self.observe(table)
 
         # Add the record to the WeakValueDictionary
         if key in self.recordByKey:
@@ -58,6 +101,8 @@ class DynamicRecordManager:
         record = event["record"]
         key = tuple([table] + [record.get(f) for f in self.db.keyfields(table)])
 
+        self.version += 1
+
         if key in self.recordByKey:
             debug.database("DynamicRecordManager.__on_insert", table, record)
 
@@ -68,6 +113,8 @@ class DynamicRecordManager:
         record = event["record"]
         key = tuple([table] + [record.get(f) for f in self.db.keyfields(table)])
 
+        self.version += 1
+
         if key in self.recordByKey:
             debug.database("DynamicRecordManager.__on_update", table, record)
 
@@ -78,8 +125,15 @@ class DynamicRecordManager:
         record = event["record"]
         key = tuple([table] + [record.get(f) for f in self.db.keyfields(table)])
 
+        self.version += 1
+        self.recordCache.pop(key)
+
         if key in self.recordByKey:
             debug.database("DynamicRecordManager.__on_delete", table, record)
 
             self.recordByKey[key].clear()
 
+    async def __on_reload(self, event):
+        self.version += 1
+        self.forget()
+
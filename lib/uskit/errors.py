@@ -13,6 +13,10 @@ class SessionClosedError(SessionError):
     def __init__(self, text):
         super().__init__(text, "XCLO")
 
+class CodecError(SessionError):
+    def __init__(self, text):
+        super().__init__(text, "XJSN")
+
 class DatabaseError(Error):
     def __init__(self, text, code="XDBX"):
         super().__init__(text, code)
@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 from . import debug
 
 
@@ -6,45 +7,107 @@ from . import debug
 # EventManager
 
 class EventManager:
-    def __init__(self):
+    """
+        Call the handlers of each type of event when an event of that type is
+        triggered.  A handler may be a coroutine function or a plain function.
+
+        The handlers of a type are kept in an insertion-ordered dict, so
+        adding and removing a handler takes constant time however many there
+        are.  A trigger calls the handlers registered when it started, even
+        if handlers are added or removed while it runs.
+
+        At most `maxConcurrency` handlers of one event run at once.  With
+        more handlers than that, they are run by as many workers, each
+        calling the next handler once it is done with the last.
+    """
+
+    def __init__(self, maxConcurrency=1000):
         self.handlersByType = {}
+        self.snapshotByType = {}
+        self.maxConcurrency = maxConcurrency
 
     def on(self, type, handler):
-        if type not in self.handlersByType:
-            self.handlersByType[type] = []
+        handlers = self.handlersByType.setdefault(type, {})
 
-        if handler not in self.handlersByType[type]:
-            self.handlersByType[type] += [handler]
+        if handler not in handlers:
+            handlers[handler] = True
+            self.snapshotByType.pop(type, None)
 
     def off(self, type, handler):
-        try:
-            handlers = self.handlersByType.get(type, [])
-            handlers.remove(handler)
+        handlers = self.handlersByType.get(type, {})
+
+        if handler in handlers:
+            del handlers[handler]
+            self.snapshotByType.pop(type, None)
 
             if len(handlers) == 0:
                 del self.handlersByType[type]
 
-        except ValueError:
-            pass
+    def handlers(self, type):
+        """
+            Return a tuple of the handlers of a type of event, built once per
+            change to its handlers.
+        """
+        snapshot = self.snapshotByType.get(type)
+
+        if snapshot is None:
+            if type not in self.handlersByType:
+                return ()
+
+            snapshot = tuple(self.handlersByType[type])
+            self.snapshotByType[type] = snapshot
+
+        return snapshot
 
     async def trigger(self, event):
         type = event.get("type")
-        tasks = []
+        handlers = self.handlers(type)
 
         debug.event("trigger", event);
 
-        for handler in self.handlersByType.get(type, []):
-            tasks += [handler(event)]
+        if len(handlers) == 1:
+            result = handlers[0](event)
+
+            if inspect.isawaitable(result):
+                await result
+
+        elif len(handlers) > self.maxConcurrency:
+            await self.__fan_out(handlers, event)
 
-        if tasks:
-            await asyncio.gather(*tasks)
+        elif handlers:
+            tasks = []
 
-        return len(tasks)
+            for handler in handlers:
+                result = handler(event)
+
+                if inspect.isawaitable(result):
+                    tasks += [result]
+
+            if len(tasks) == 1:
+                await tasks[0]
+            elif tasks:
+                await asyncio.gather(*tasks)
+
+        return len(handlers)
+
+    async def __fan_out(self, handlers, event):
+        """
+            Call the handlers from `maxConcurrency` workers.
+        """
+        pending = iter(handlers)
+
+        async def worker():
+            for handler in pending:
+                result = handler(event)
+
+                if inspect.isawaitable(result):
+                    await result
+
+        await asyncio.gather(*[worker() for i in range(self.maxConcurrency)])
 
 
 ##############################################################################
 # FACTORY
 
-def event_manager():
-    return EventManager()
-
+def event_manager(**kwargs):
+    return EventManager(**kwargs)
@@ -0,0 +1,319 @@
+import re
+import sys
+import json
+import asyncio
+from . import debug
+from . import query_view
+from .query import Query
+from .query_service import QueryData
+
+
+##############################################################################
+# GLOBALS
+
+PLAN_RE = re.compile(r"^(SCAN|SEARCH) (\w+)\b(.*)$")
+
+
+##############################################################################
+# INDEX ADVISOR
+
+class IndexAdvisor:
+    """
+        Find the selects of a query config that scan a table or sort rows
+        in a temporary B-tree, and recommend indexes to avoid them.
+
+        Every shape of SQL that Query and QueryData emit for the config is
+        built: the snapshot, a page after a `lastrow`, the lookup of the rows
+        affected by a change to each table, and the allowWhere check.  Each
+        is run through EXPLAIN QUERY PLAN.  A full read of the outermost
+        table by the snapshot is expected and not reported.
+    """
+
+    def __init__(self, db, queryCfg):
+        self.db = db
+        self.queryCfg = queryCfg
+        self.queryData = QueryData(db, queryCfg)
+        self.query = self.queryData.query
+
+    def shapes(self):
+        """
+            Return the name, joinspec, SQL statement, and arguments of each
+            shape of select of the query.
+        """
+        joinspec = self.queryCfg["joinspec"]
+        lastrow = { field : None for field in self.query.sortfields }
+        shapes = [
+            ("snapshot", joinspec, *self.query.statement(**self.__kwargs(self.query))),
+            ("page", joinspec, *self.query.statement(lastrow=lastrow, maxcount=1, **self.__kwargs(self.query))),
+        ]
+
+        for table in self.queryData.aliasByTable.keys():
+            key = tuple(None for keyfield in self.db.keyfields(table))
+            (where, args) = self.queryData.keyed_where(table, [key])
+
+            shapes += [(f"lookup {table}", joinspec, *self.query.statement(where=where, args=args, **self.__kwargs(self.query)))]
+
+        if "allowWhere" in self.queryCfg:
+            allowWhere = Query(self.db, self.queryCfg["allowWhere"])
+
+            shapes += [("allowWhere", self.queryCfg["allowWhere"], *allowWhere.statement(**self.__kwargs(allowWhere)))]
+
+        return shapes
+
+    def recommend(self, shape, joinspec, alias):
+        """
+            Return the columns of an alias to index to avoid scanning it in a
+            shape of select.
+        """
+        aliases = [spec["alias"] for spec in joinspec]
+        fields = self.__filter_columns(joinspec, alias)
+
+        # Join to the alias from the other aliases
+        if alias != joinspec[0]["alias"]:
+            return fields + [f for f in self.__equal_columns(joinspec, alias, aliases) if f not in fields]
+
+        # Range of the sort order
+        if shape == "page":
+            return self.__sort_fields()
+
+        # Join from the looked up aliases, unless rows without them are also
+        # looked up
+        if shape.startswith("lookup "):
+            lookups = self.queryData.aliasByTable[shape.split(" ", 1)[1]]
+
+            if not set(lookups) & self.queryData.nullableAliases:
+                return self.__equal_columns(joinspec, alias, lookups)
+
+        return fields
+
+    async def analyze(self):
+        """
+            Return a finding for each problem step of the plan of each shape:
+            a dict of the query name, the shape, the step, the index that
+            would avoid it, if any, as a dict of the table, index name, and
+            fields, and the reason if there is none.
+        """
+        findings = []
+
+        for (shape, joinspec, sqlstmt, args) in self.shapes():
+            root = joinspec[0]["alias"]
+            tableByAlias = { spec["alias"] : spec["table"] for spec in joinspec }
+
+            steps = await self.db.explain(sqlstmt, args)
+            outer = next((step for step in steps if PLAN_RE.match(step)), None)
+
+            for step in steps:
+                match = PLAN_RE.match(step)
+                fields = []
+
+                # Keys bound as JSON are read with json_each(), which is not
+                # an alias of the query
+                if match and match.group(2) not in tableByAlias:
+                    continue
+
+                if match and (match.group(1) == "SCAN" or "AUTOMATIC" in step):
+                    alias = match.group(2)
+                    fields = self.recommend(shape, joinspec, alias)
+                elif step.startswith("USE TEMP B-TREE") and "ORDER BY" in step and shape.startswith("lookup "):
+                    # Lookups select few rows, which are cheap to sort
+                    continue
+                elif step.startswith("USE TEMP B-TREE FOR ORDER BY"):
+                    alias = root
+                    fields = self.__sort_fields() if shape != "allowWhere" else []
+                elif step.startswith("USE TEMP B-TREE"):
+                    alias = root
+                else:
+                    continue
+
+                index = await self.__index(tableByAlias.get(alias), fields)
+
+                # Reading all of the outermost table is the point of a snapshot
+                if shape == "snapshot" and step is outer and index is None:
+                    continue
+
+                findings += [{
+                    "query"  : self.queryCfg.get("queryName"),
+                    "shape"  : shape,
+                    "step"   : step,
+                    "index"  : index,
+                    "reason" : None if index else self.__reason(shape, step, joinspec, alias, tableByAlias.get(alias), fields),
+                }]
+
+        return findings
+
+    def __reason(self, shape, step, joinspec, alias, table, fields):
+        """
+            Return why no index is recommended for a step on an alias.
+        """
+        if fields and step.startswith("USE TEMP B-TREE"):
+            return f"{table} already has an index on ({', '.join(fields)}), but the sort order goes on to other columns"
+
+        if fields:
+            return f"{table} already has an index on ({', '.join(fields)}), which SQLite chose not to use"
+
+        # Rows without a looked up alias can only be found by reading every
+        # row of the outermost table
+        if shape.startswith("lookup ") and alias == joinspec[0]["alias"]:
+            lookups = self.queryData.aliasByTable[shape.split(" ", 1)[1]]
+            nullables = [a for a in lookups if a in self.queryData.nullableAliases]
+
+            if nullables:
+                return f"rows without {', '.join(nullables)} are also looked up, which no index on {table} can find"
+
+        return f"no column of {table} is compared for equality or sorted on"
+
+    def __kwargs(self, query):
+        """
+            Return the keyword arguments that set every argument of a query to
+            None.
+        """
+        kwargs = {}
+
+        for expr in query.expressions:
+            node = kwargs
+
+            for name in expr.ast[:-1]:
+                node = node.setdefault(name, {})
+
+            node[expr.ast[-1]] = None
+
+        return kwargs
+
+    def __filter_columns(self, joinspec, alias):
+        """
+            Return the columns of an alias that its filter compares for
+            equality to a value.
+        """
+        spec = next(spec for spec in joinspec if spec["alias"] == alias)
+        fields = []
+
+        for column in re.findall(rf"\b{alias}\.(\w+)\s*=\s*(?:\?|'|-?\d)", spec.get("where", "")):
+            if column not in fields:
+                fields += [column]
+
+        return fields
+
+    def __equal_columns(self, joinspec, alias, others):
+        """
+            Return the columns of an alias that the join conditions compare
+            for equality to columns of any of the `others` aliases.
+        """
+        fields = []
+
+        for spec in joinspec[1:]:
+            for condition in re.split(r"\s+and\s+", spec["joinOn"], flags=re.IGNORECASE):
+                match = query_view.EQUALS_RE.match(condition)
+
+                if match:
+                    (a1, c1, a2, c2) = match.groups()
+
+                    if   a1 == alias and a2 != alias and a2 in others and c1 not in fields : fields += [c1]
+                    elif a2 == alias and a1 != alias and a1 in others and c2 not in fields : fields += [c2]
+
+        return fields
+
+    def __sort_fields(self):
+        """
+            Return the leading sort fields that are columns of the first
+            table, up to its key fields.
+        """
+        joinspec = self.queryCfg["joinspec"]
+        root = joinspec[0]["alias"]
+        sourceByName = { spec["name"] : spec["source"] for spec in self.queryCfg.get("fields", []) }
+        keyfields = self.db.keyfields(joinspec[0]["table"])
+        fields = []
+
+        for name in self.query.sortfields:
+            match = query_view.COLUMN_RE.match(sourceByName.get(name, name))
+
+            if not match or match.group(1) != root or match.group(2) == "rowid":
+                break
+
+            fields += [match.group(2)]
+
+            if set(keyfields) <= set(fields):
+                break
+
+        return fields
+
+    async def __index(self, table, fields):
+        """
+            Return the recommended index on the fields of a table, or None if
+            there are no fields or an existing index already starts with them.
+        """
+        if not table or not fields:
+            return None
+
+        for indexfields in await self.db.indexes(table):
+            if indexfields[:len(fields)] == fields:
+                return None
+
+        return {
+            "table"  : table,
+            "name"   : f"{table}_BY_{'_'.join(fields)}",
+            "fields" : fields,
+        }
+
+
+##############################################################################
+# FACTORY
+
+async def index_advisor(db, *cfgfiles, create=False):
+    """
+        Analyze the query config files and log the selects that scan a table
+        or sort in a temporary B-tree, along with the recommended indexes.
+        If `create` is True, also create the recommended indexes.  Return the
+        findings; see `IndexAdvisor.analyze()`.
+    """
+    findings = []
+
+    for cfgfile in cfgfiles:
+        with open(cfgfile) as fd:
+            advisor = IndexAdvisor(db, json.load(fd))
+
+        findings += await advisor.analyze()
+
+    for finding in findings:
+        index = finding["index"]
+        advice = f"index {index['name']} on {index['table']} ({', '.join(index['fields'])})" if index else f"no index recommended: {finding['reason']}"
+
+        debug.warning(f"{finding['query']} {finding['shape']}: {finding['step']}: {advice}")
+
+    if create:
+        for index in { f["index"]["name"] : f["index"] for f in findings if f["index"] }.values():
+            debug.info(f"Creating index {index['name']} on {index['table']} ({', '.join(index['fields'])})")
+
+            await db.create_index(index["table"], index["name"], index["fields"])
+
+    return findings
+
+
+##############################################################################
+# COMMAND LINE
+
+async def main(args):
+    """
+        usage: python3 -m uskit.index_advisor [--create] [--dbfile=FILE]
+                   [--datafile=FILE ...] DBCFG QUERYCFG ...
+    """
+    from .database import database
+
+    options = [a for a in args if a.startswith("--")]
+    files = [a for a in args if not a.startswith("--")]
+    dbfile = next((o.split("=", 1)[1] for o in options if o.startswith("--dbfile=")), None)
+    datafiles = [o.split("=", 1)[1] for o in options if o.startswith("--datafile=")]
+
+    if len(files) < 2:
+        sys.stderr.write(main.__doc__.strip() + "\n")
+        return 2
+
+    db = await database(files[0], dbfile=dbfile, datafiles=datafiles)
+    findings = await index_advisor(db, *files[1:], create="--create" in options)
+
+    await db.close()
+    debug.flush()
+
+    return 1 if findings else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,234 @@
+import json
+import collections.abc
+from . import util
+from . import errors
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+##############################################################################
+# GLOBALS
+
+# True if orjson can splice the encoding of a util.JsonRecord itself
+FRAGMENTS = orjson is not None and hasattr(orjson, "Fragment")
+
+# Stands in for each util.JsonRecord in a shared message until it is spliced
+PLACEHOLDER = "__uskit_record__"
+
+
+##############################################################################
+# JSON CODEC
+
+def default(value):
+    """
+        Encode values that the codecs do not: mappings, like database rows,
+        as objects, and anything else as a string.
+    """
+    if isinstance(value, collections.abc.Mapping):
+        return dict(value)
+
+    return str(value)
+
+
+class JsonCodec:
+    """
+        Encode and decode messages using the standard library.  Messages are
+        encoded in one call to dumps(), except that a util.JsonRecord in a
+        shared message is encoded only once and its encoding spliced into
+        every message it is sent in.  Subclasses only need to provide dumps()
+        and loads().
+    """
+    name = "json"
+    binary = False
+
+    def __init__(self):
+        self.placeholder = self.dumps(PLACEHOLDER)
+
+    def dumps(self, value):
+        return json.dumps(value, default=default)
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def encode(self, value, shared=False):
+        """
+            Encode a message.  The result is a str or bytes, either of which
+            may be written to a websocket as a text message.  `shared` is
+            True if the util.JsonRecords in the message are also sent to
+            other sessions, so their encodings are worth caching.
+        """
+        if shared:
+            encoded = []
+            skeleton = self.__skeleton(value, encoded)
+
+            if encoded:
+                return self.__splice(value, skeleton, encoded)
+
+        return self.dumps(value)
+
+    def __skeleton(self, value, encoded):
+        """
+            Return a copy of the containers in `value` with each
+            util.JsonRecord replaced by PLACEHOLDER, and add the encodings of
+            the records to `encoded` in the order dumps() encodes them.
+        """
+        if type(value) is dict:
+            return { k : self.__skeleton(v, encoded) for k, v in value.items() }
+
+        if type(value) is list or type(value) is tuple:
+            skeleton = []
+
+            # Rows are usually in a list, so check for them without recursing
+            for v in value:
+                if type(v) is util.JsonRecord:
+                    encoded += [v.encode(self)]
+                    skeleton += [PLACEHOLDER]
+                else:
+                    skeleton += [self.__skeleton(v, encoded)]
+
+            return skeleton
+
+        if type(value) is util.JsonRecord:
+            encoded += [value.encode(self)]
+            return PLACEHOLDER
+
+        return value
+
+    def __splice(self, value, skeleton, encoded):
+        parts = self.dumps(skeleton).split(self.placeholder)
+
+        # PLACEHOLDER also appears elsewhere in the message
+        if len(parts) != len(encoded) + 1:
+            return self.dumps(value)
+
+        spliced = [None] * (len(parts) + len(encoded))
+        spliced[0::2] = parts
+        spliced[1::2] = encoded
+
+        return parts[0][:0].join(spliced)
+
+    def decode(self, data):
+        try:
+            return self.loads(data)
+        except ValueError as e:
+            raise errors.CodecError(str(e))
+
+
+##############################################################################
+# ORJSON CODEC
+
+class OrjsonCodec(JsonCodec):
+    """
+        Encode and decode messages using orjson.  If this version of orjson
+        supports fragments, it splices the encoding of each util.JsonRecord
+        in a shared message itself.  Otherwise, the records are encoded again
+        for every message, which orjson does about as fast as they can be
+        spliced in.
+    """
+    name = "orjson"
+
+    def dumps(self, value):
+        return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def encode(self, value, shared=False):
+        if shared and FRAGMENTS:
+            return orjson.dumps(value, default=self.__default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+        return self.dumps(value)
+
+    def __default(self, value):
+        if isinstance(value, util.JsonRecord):
+            return orjson.Fragment(value.encode(self))
+
+        if   isinstance(value, dict) : return dict(value)
+        elif isinstance(value, list) : return list(value)
+        elif isinstance(value, int)  : return int(value)
+        else                         : return default(value)
+
+
+##############################################################################
+# UJSON CODEC
+
+class UjsonCodec(JsonCodec):
+    """
+        Encode and decode messages using ujson.
+    """
+    name = "ujson"
+
+    def dumps(self, value):
+        return ujson.dumps(value, default=default, escape_forward_slashes=False)
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+##############################################################################
+# MSGPACK CODEC
+
+class MsgpackCodec(JsonCodec):
+    """
+        Encode and decode messages as MessagePack, sent as binary websocket
+        messages.  Unlike JSON, non-string keys are sent as they are.
+    """
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        self.packer = msgpack.Packer(default=default)
+        super().__init__()
+
+    def dumps(self, value):
+        return self.packer.pack(value)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+    def decode(self, data):
+        try:
+            return self.loads(data)
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise errors.CodecError(str(e))
+
+
+##############################################################################
+# FACTORY
+
+def json_codec(name="json"):
+    """
+        Create and return a codec by name: "json" (the default), "orjson",
+        "ujson", "msgpack", or "auto" for the fastest JSON codec installed.
+    """
+    if name == "auto":
+        if   orjson : name = "orjson"
+        elif ujson  : name = "ujson"
+        else        : name = "json"
+
+    if   name == "json"                : return JsonCodec()
+    elif name == "orjson" and orjson   : return OrjsonCodec()
+    elif name == "ujson" and ujson     : return UjsonCodec()
+    elif name == "msgpack" and msgpack : return MsgpackCodec()
+    else                               : raise errors.CodecError(f"{name}: Codec not available")
+
+
+def json_record(row):
+    """
+        Return a query row to send to sessions as a util.JsonRecord, so it is
+        encoded only once per codec however many sessions it is sent to.
+    """
+    return util.JsonRecord(row)
@@ -1,4 +1,5 @@
 import asyncio
+from . import util
 from . import debug
 from . import expression
 
@@ -7,6 +8,17 @@ from . import expression
 # QUERY
 
 class Query:
+    """
+        A select of joined tables.
+
+        The SQL of each shape of call (sort fields, where clause, and whether
+        there is a `lastrow` or a `maxcount`) is compiled once and kept in
+        `Query.sqlCache`, an LRU cache shared by every query, so later calls
+        of the same shape only bind their arguments.  `Query.sqlCache.stats()`
+        returns its size and hit rate.
+    """
+    sqlCache = util.LruCache(256)
+
     def __init__(self, db, joinspec, fieldspec=[]):
         self.db = db
         self.sortfields = []
@@ -75,51 +87,99 @@ class Query:
         """
 
     async def __call__(self, **kwargs):
+        async for rows in self.batches(**kwargs):
+            for row in rows:
+                yield row
+
+    async def batches(self, **kwargs):
+        """
+            Same as calling the query, but yield the rows in batches of up to
+            `fetchSize` rows as fetched from the database.  Each row is a
+            `rowType`, a dict by default.
+        """
+        rowType = kwargs.get("rowType", dict)
+        (sql, args) = self.statement(**kwargs)
+
+        # Debug output
+        debug.database(debug.lazy(lambda: "select " + sql), args)
+
+        # Select
+        async for rows in self.db.select_batches(sql, args, writer=kwargs.get("writer", False), fetchSize=kwargs.get("fetchSize")):
+            yield [row.asdict(rowType) for row in rows]
+
+    def statement(self, **kwargs):
+        """
+            Return the SQL statement (without the leading "select") and the
+            arguments that calling the query with `kwargs` would select with.
+
+            `sources` maps table names to the (sql, args) of a select to read
+            each table from instead, e.g., as it was before a change.  Its
+            columns must be the rowid and the fields of the table.
+        """
         sortfields = kwargs.get("sortfields", []) + self.sortfields
         maxcount = kwargs.get("maxcount", "")
         lastrow = kwargs.get("lastrow", {})
-        where = self.where + [kwargs.get("where", "1")]
+        where = kwargs.get("where", "1")
+        key = (self.sql, tuple(self.where), tuple(sortfields), where, bool(lastrow), bool(maxcount))
+        compiled = Query.sqlCache.get(key)
         args = []
-        sql = ""
+
+        if compiled is None:
+            compiled = self.__compile(sortfields, where, lastrow, maxcount)
+            Query.sqlCache.set(key, compiled)
+
+        (sql, criteria) = compiled
 
         # Start range
         if lastrow:
-            criteria = {}
+            args += [lastrow.get(field, 0) for field in criteria]
+
+        # Arguments
+        for expr in self.expressions:
+            args += [expr(**kwargs)]
 
-            # Criteria
-            for field in sortfields:
-                if field not in criteria:
-                    criteria[field] = lastrow.get(field,0)
+        args += kwargs.get("args",[])
+
+        # End range
+        if maxcount:
+            args += [maxcount]
+
+        # Tables read from elsewhere, shadowed by a CTE of the same name
+        if kwargs.get("sources"):
+            sources = kwargs["sources"]
+            ctes = ", ".join(f"{table} as ({srcsql})" for table, (srcsql, srcargs) in sources.items())
+            sql = f"* from (with {ctes} select {sql})"
+            args = [arg for (srcsql, srcargs) in sources.values() for arg in srcargs] + args
 
-            where += [f"({', '.join(criteria.keys())}) > ({', '.join(['?'] * len(criteria))})"]
+        return (sql, args)
 
-            # Arguments
-            args += list(criteria.values())
+    def __compile(self, sortfields, where, lastrow, maxcount):
+        """
+            Return the SQL of a call of the query, and the sort fields whose
+            values in `lastrow` are its start range arguments.
+        """
+        where = self.where + [where]
+        criteria = []
+        limit = ""
+
+        # Start range
+        if lastrow:
+            criteria = list(dict.fromkeys(sortfields))
+            where += [f"({', '.join(criteria)}) > ({', '.join(['?'] * len(criteria))})"]
 
         # End range
         if maxcount:
-            maxcount = f"limit {maxcount}"
+            limit = "limit ?"
 
         # Select statement
         sql = f"""
             {self.sql}
             where ({") and (".join(where)})
             order by {", ".join(sortfields)}
-            {maxcount}
+            {limit}
         """
 
-        # Arguments
-        for expr in self.expressions:
-            args += [expr(**kwargs)]
-
-        args += kwargs.get("args",[])
-
-        # Debug output
-        debug.database("select " + sql, args)
-
-        # Select
-        async for found in self.db.select(sql, args):
-            yield found
+        return (sql, criteria)
 
 
 ##############################################################################
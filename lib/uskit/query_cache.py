@@ -0,0 +1,216 @@
+import bisect
+import asyncio
+from . import debug
+
+
+##############################################################################
+# QUERY CACHE
+
+class QueryCache:
+    """
+        Keep the query result rows in memory, sorted in the same order as the
+        query, so snapshot pages can be served without querying the database.
+
+        At most `maxrows` rows are kept.  If the result set is larger than
+        that, only the first `maxrows` rows (in sort order) are kept, and any
+        page that reaches past them is served by the database instead.
+
+        The cached rows are also indexed by each part of their rowid, i.e.,
+        the rowid of each joined record, so the rows that include a record
+        can be found without scanning the cache.
+    """
+
+    def __init__(self, queryData, sortfields, maxrows):
+        self.queryData = queryData
+        self.sortfields = sortfields
+        self.maxrows = maxrows
+        self.isWarm = False
+        self.isWarming = False
+        self.isTruncated = False
+        self.boundary = None
+        self.warmTask = None
+        self.pending = []
+        self.keys = []
+        self.rowids = []
+        self.rowByRowId = {}
+        self.rowidsByPart = {}
+
+    def __sortkey(self, row):
+        """
+            Return a key that sorts the same way the database sorts rows:
+            NULLs first, then numbers, then text, then blobs.
+        """
+        key = []
+
+        for field in self.sortfields:
+            value = row.get(field, 0)
+
+            if   value is None                  : key += [(0, 0)]
+            elif isinstance(value, (int,float)) : key += [(1, value)]
+            elif isinstance(value, str)         : key += [(2, value)]
+            else                                : key += [(3, value)]
+
+        return tuple(key)
+
+    def __index(self, key, rowid):
+        index = bisect.bisect_left(self.keys, key)
+
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.rowids[index] == rowid:
+                return index
+
+            index += 1
+
+        return None
+
+    def __remove(self, rowid):
+        if rowid in self.rowByRowId:
+            key = self.__sortkey(self.rowByRowId[rowid])
+            index = self.__index(key, rowid)
+
+            del self.keys[index]
+            del self.rowids[index]
+            del self.rowByRowId[rowid]
+            self.__unindex(rowid)
+
+    def __add(self, row):
+        rowid = row["__rowid__"]
+        key = self.__sortkey(row)
+
+        # Rows past the last cached row are not tracked
+        if self.isTruncated and key > self.boundary:
+            return
+
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.rowids.insert(index, rowid)
+        self.rowByRowId[rowid] = row
+        self.__reindex(rowid)
+
+        # Evict from the end if over the limit, including any rows that sort
+        # the same as the evicted row so the cached rows remain a prefix
+        if len(self.keys) > self.maxrows:
+            evicted = self.keys[-1]
+
+            while self.keys and self.keys[-1] == evicted:
+                self.__unindex(self.rowids[-1])
+                del self.rowByRowId[self.rowids[-1]]
+                del self.keys[-1]
+                del self.rowids[-1]
+
+            self.isTruncated = True
+            self.boundary = self.keys[-1] if self.keys else ()
+
+    def __reindex(self, rowid):
+        for part in enumerate(rowid.split("|")):
+            self.rowidsByPart.setdefault(part, set()).add(rowid)
+
+    def __unindex(self, rowid):
+        for part in enumerate(rowid.split("|")):
+            rowids = self.rowidsByPart[part]
+            rowids.discard(rowid)
+
+            if not rowids:
+                del self.rowidsByPart[part]
+
+    def rows_by_part(self, index, parts):
+        """
+            Return the cached rows whose rowid has any of `parts` as its
+            `index`th part, keyed by the rowid.
+        """
+        rows = {}
+
+        for part in parts:
+            for rowid in self.rowidsByPart.get((index, part), ()):
+                rows[rowid] = self.rowByRowId[rowid]
+
+        return rows
+
+    def covers(self, row):
+        """
+            Return True if the cache is warm and holds every result row that
+            sorts like `row`, i.e., whether `row` is cached is whether it is
+            in the result as last notified.
+        """
+        return self.isWarm and (not self.isTruncated or self.__sortkey(row) <= self.boundary)
+
+    def __apply(self, operation, row):
+        self.__remove(row["__rowid__"])
+
+        if operation != "delete":
+            self.__add(row)
+
+    def apply(self, operation, row):
+        """
+            Apply a change to a query result row.  Changes that arrive while
+            the cache is warming up are replayed once it is warm.
+        """
+        if   self.isWarm    : self.__apply(operation, row)
+        elif self.isWarming : self.pending += [(operation, row)]
+
+    def clear(self):
+        """
+            Empty the cache, including any warm up in progress.  The cache is
+            warmed up again on the next request.
+        """
+        if self.warmTask:
+            self.warmTask.cancel()
+
+        self.__reset()
+
+    def __reset(self):
+        self.isWarm = False
+        self.isTruncated = False
+        self.boundary = None
+        self.pending = []
+        self.keys = []
+        self.rowids = []
+        self.rowByRowId = {}
+        self.rowidsByPart = {}
+
+    def page(self, lastrow, maxcount):
+        """
+            Return the rows after `lastrow`, up to `maxcount` rows, or None if
+            the cache cannot answer the request.
+        """
+        if not self.isWarm:
+            if not self.isWarming:
+                self.__reset()
+                self.isWarming = True
+                self.warmTask = asyncio.create_task(self.__warm())
+
+            return None
+
+        start = bisect.bisect_right(self.keys, self.__sortkey(lastrow)) if lastrow else 0
+        end = start + maxcount if maxcount else None
+
+        # The requested page reaches past the cached rows
+        if self.isTruncated and (end is None or end > len(self.keys)):
+            return None
+
+        return [self.rowByRowId[rowid] for rowid in self.rowids[start:end]]
+
+    async def __warm(self):
+        """
+            Read the rows from the writer, which also sees the changes of a
+            transaction in progress whose events have already been applied
+            (or queued), since readers do not see them until they commit.
+        """
+        try:
+            async for rows in self.queryData.batches(maxcount=self.maxrows + 1, writer=True):
+                for row in rows:
+                    self.__add(row)
+
+            for operation, row in self.pending:
+                self.__apply(operation, row)
+
+            self.isWarm = True
+            self.pending = []
+
+        except Exception as e:
+            debug.error("QueryCache.__warm()", str(e))
+            self.__reset()
+
+        finally:
+            self.isWarming = False
+            self.warmTask = None
@@ -1,25 +1,36 @@
 import os
 import json
 import asyncio
+from . import util
 from . import debug
 from . import query
 from . import errors
+from . import json_codec
 from . import service
+from . import query_view
+from . import query_cache
 from . import event_manager
 
 
+##############################################################################
+# GLOBALS
+
+# The most records whose result rows are looked up by one query
+MAX_KEYS = 1000
+
+
 ##############################################################################
 # QUERY SERVICE
 
 @service
 class QueryService:
-    pid = os.getpid()
     qid = 0
 
     def __nextqid(self):
         QueryService.qid += 1
 
-        return f"Q{QueryService.pid}-{QueryService.qid}"
+        # The process ID is looked up each time since workers are forked
+        return f"Q{os.getpid()}-{QueryService.qid}"
 
     def __init__(self, db, queryData, queryCfg):
         self.db = db
@@ -38,6 +49,7 @@ class QueryService:
         self.session = event["session"]
 
         self.session.on(f"close", self.__on_close)
+        self.session.on("drain", self.__on_drain)
         self.session.on(f"{self.queryName}", self.__on_query)
         self.session.on(f"{self.queryName}_NEXT", self.__on_next)
 
@@ -52,6 +64,15 @@ class QueryService:
 
         self.queryInstances = {}
 
+    async def __on_drain(self, event):
+        tasks = []
+
+        for queryInstance in list(self.queryInstances.values()):
+            tasks += [queryInstance.trigger(event)]
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
     async def __on_query(self, event):
         message = event["message"]
         messageId = message.get("MESSAGE_ID", "0");
@@ -77,8 +98,15 @@ class QueryService:
                 },
             })
 
-    async def send(self, message):
-        await self.session.send(message)
+    async def send(self, message, shared=False):
+        await self.session.send(message, shared)
+
+    def is_congested(self):
+        """
+            Return True if query updates should be held back, and conflated,
+            until the session drains.
+        """
+        return self.session.policy == "conflate" and self.session.is_congested()
 
 
 ##############################################################################
@@ -88,6 +116,14 @@ class QueryInstance:
     """
         A client has requested query.  Track the state of the communication
         about this one query from one client.
+
+        Once the client has the whole result, each reply that leaves no
+        changes queued carries the "SEQ" of the last change sent to it.  If
+        the client requests the query again with that SEQ in its CONTENT,
+        e.g., after reconnecting, the query is acknowledged without a SCHEMA
+        and the changes to the result since then are sent as an UPDATE, if
+        the query's change log still has them all.  Otherwise a SNAPSHOT is
+        sent as usual.
     """
     STATE_SNAPSHOT = 0x01
     STATE_UPDATE   = 0x02
@@ -104,23 +140,32 @@ class QueryInstance:
         self.maxcount = 500
         self.lastrow = {}
         self.queueByRowId = {}
-
-        self.queryData.on("insert", self.__on_insert)
-        self.queryData.on("update", self.__on_update)
-        self.queryData.on("delete", self.__on_delete)
+        self.flushInterval = queryCfg.get("flushIntervalMs", 0) / 1000
+        self.maxBatchRows = queryCfg.get("maxBatchRows", 500)
+        self.flushTask = None
+        self.seq = 0
+        self.isSynced = False
 
     async def trigger(self, event):
         type = event["type"]
 
         if   type == "close"                  : await self.__on_close(event)
+        elif type == "drain"                  : await self.__on_drain(event)
         elif type == f"{self.queryName}"      : await self.__on_query(event)
         elif type == f"{self.queryName}_NEXT" : await self.__on_next(event)
         else                                  : debug.debug("Unhandled event", event)
 
     async def __on_close(self, event):
-        self.queryData.off("insert", self.__on_insert)
-        self.queryData.off("update", self.__on_update)
-        self.queryData.off("delete", self.__on_delete)
+        self.queryData.off("changes", self.__on_changes)
+        self.queryData.off("reload", self.__on_reload)
+
+        if self.flushTask:
+            self.flushTask.cancel()
+            self.flushTask = None
+
+    async def __on_drain(self, event):
+        if self.state == QueryInstance.STATE_UPDATE and self.queueByRowId:
+            await self.__flush_queue()
 
     async def __on_query(self, event):
         message = event["message"]
@@ -137,6 +182,16 @@ class QueryInstance:
 
         # Query if permissioned
         if allowQuery:
+            self.queryData.on("changes", self.__on_changes)
+            self.queryData.on("reload", self.__on_reload)
+            self.seq = self.queryData.seq
+            changes = self.__changes_since(message)
+
+            # Resume if the changes since the client's SEQ are all known
+            if changes is not None:
+                await self.__on_resume(message, changes)
+                return
+
             await self.__send({
                 "MESSAGE_TYPE" : f"{queryName}_ACK",
                 "REPLY_TO_ID"  : message.get("MESSAGE_ID"),
@@ -159,30 +214,132 @@ class QueryInstance:
 
             await self.__on_close(event)
 
+    async def __on_resume(self, message, changes):
+        """
+            Send the changes since the client's SEQ in place of a snapshot.
+        """
+        self.state = QueryInstance.STATE_UPDATE
+        self.lastrow = None
+        self.isSynced = True
+
+        for seq, change in changes:
+            self.__push_queue(change["operation"].upper(), change["row"])
+
+        await self.__send({
+            "MESSAGE_TYPE" : f"{self.queryName}_ACK",
+            "REPLY_TO_ID"  : message.get("MESSAGE_ID"),
+            "CONTENT"      : {
+                "QUERY_ID" : self.queryId,
+            },
+        })
+
+        await self.__send_queue(message=message)
+
+    def __changes_since(self, message):
+        """
+            Return the changes to the result since the SEQ in the CONTENT of
+            a message, or None if there is no SEQ or the changes are not all
+            known.
+        """
+        seq = message.get("CONTENT", {}).get("SEQ")
+
+        try:
+            (logId, seq) = seq.split(":")
+            seq = int(seq)
+        except (AttributeError, ValueError):
+            return None
+
+        if logId != self.db.logId:
+            return None
+
+        return self.queryData.changes_since(seq)
+
     async def __on_next(self, event):
         message = event["message"]
         self.maxcount = message.get("CONTENT", {}).get("MAXCOUNT", self.maxcount)
 
-        async for row in self.queryData.query(lastrow=self.lastrow, maxcount=self.maxcount):
-            self.__push_queue("INSERT", row)
-            self.lastrow = row
+        await self.__send_page(message=message)
 
-        await self.__send_queue(message=message)
+    async def __on_reload(self, event):
+        """
+            The result was reloaded, so the changes to it are unknown.  Start
+            over with a snapshot, which has the SCHEMA so the client discards
+            the rows it has.
+        """
+        if self.flushTask:
+            self.flushTask.cancel()
+            self.flushTask = None
+
+        self.state = QueryInstance.STATE_SNAPSHOT
+        self.lastrow = {}
+        self.queueByRowId = {}
+        self.isSynced = False
+        self.seq = max(self.seq, event["seq"])
+
+        await self.__send_page(addSchema=True)
+
+    async def __send_page(self, **kwargs):
+        """
+            Send the next page of the snapshot, if any, with the queued
+            changes.
+        """
+        # Nothing to read if resumed without a snapshot
+        if self.lastrow is not None:
+            count = 0
+
+            async for row in self.queryData.snapshot(lastrow=self.lastrow, maxcount=self.maxcount):
+                self.__push_queue("INSERT", row)
+                self.lastrow = row
+                count += 1
+
+            if count < self.maxcount:
+                self.isSynced = True
+
+        await self.__send_queue(**kwargs)
+
+    async def __on_changes(self, event):
+        for change in event["changes"]:
+            self.__push_queue(change["operation"].upper(), change["row"])
+
+        self.seq = max(self.seq, event["seq"])
+
+        await self.__flush_queue()
+
+    async def __flush_queue(self):
+        """
+            Send the queued changes now if they are not being coalesced or if
+            enough of them have accumulated, otherwise send them at the end
+            of the flush interval.  Changes to the same row in the meantime
+            are conflated into one.  Changes are also held while the session
+            is congested, and sent once it drains.
+        """
+        if self.queryService.is_congested():
+            return
+
+        if not self.flushInterval:
+            # As many replies as it takes; only the last one is marked last
+            while self.queueByRowId and not self.queryService.is_congested():
+                await self.__send_queue(isLast=len(self.queueByRowId) <= self.maxcount)
+
+        else:
+            while len(self.queueByRowId) >= min(self.maxBatchRows, self.maxcount) and not self.queryService.is_congested():
+                if self.flushTask:
+                    self.flushTask.cancel()
+                    self.flushTask = None
 
-    async def __on_insert(self, event):
-        row = event["row"]
-        self.__push_queue("INSERT", row)
-        await self.__send_queue()
+                await self.__send_queue(isLast=len(self.queueByRowId) <= self.maxcount)
 
-    async def __on_update(self, event):
-        row = event["row"]
-        self.__push_queue("UPDATE", row)
-        await self.__send_queue()
+            # The rest are sent at the end of the flush interval
+            if self.queueByRowId and not self.flushTask:
+                self.flushTask = asyncio.create_task(self.__flush_later())
 
-    async def __on_delete(self, event):
-        row = event["row"]
-        self.__push_queue("DELETE", row)
-        await self.__send_queue()
+    async def __flush_later(self):
+        await asyncio.sleep(self.flushInterval)
+
+        self.flushTask = None
+
+        if self.queueByRowId and not self.queryService.is_congested():
+            await self.__send_queue()
 
     def __push_queue(self, operation, row):
         rowid = row["__rowid__"]
@@ -243,15 +400,20 @@ class QueryInstance:
                     break
 
             # Add isLast
-            if count < self.maxcount:
+            if count < self.maxcount or kwargs.get("isLast", False):
                 queryReply["CONTENT"]["IS_LAST"] = True
                 self.state = QueryInstance.STATE_UPDATE
             else:
                 queryReply["CONTENT"]["IS_LAST"] = False
 
-            await self.__send(queryReply)
+            # Add the SEQ to resume from once the client has every change
+            if self.isSynced and not self.queueByRowId:
+                queryReply["CONTENT"]["SEQ"] = f"{self.db.logId}:{self.seq}"
+
+            # Rows sent to other observers too are worth encoding only once
+            await self.__send(queryReply, self.queryData.is_shared())
 
-    async def __send(self, message):
+    async def __send(self, message, shared=False):
         """
             Attempt to send a message over the session.  If the session is
             closed, stop observing and let the garbage collector collect this
@@ -259,7 +421,7 @@ class QueryInstance:
         """
 
         try:
-            await self.queryService.send(message)
+            await self.queryService.send(message, shared)
         except errors.SessionClosedError as e:
             await self.__on_close({
                 "type" : "close",
@@ -273,15 +435,62 @@ class QueryData:
     """
         Store data that a client may request in a format appropriate for a
         query response.
+
+        The changes to the result are notified to the observers in the
+        order of the database changes that caused them, as a "changes" event
+        with the "seq" of the last of them.  Each of its "changes" has the
+        "operation" ("insert", "update", or "delete") and the "row".  Each
+        change is then also notified as an "insert", "update", or "delete"
+        event of its "row", as before there were "changes" events.  A
+        "reload" event means the changes to the result are unknown.
+
+        The last `changeLogSize` changes are kept, so the changes since a seq
+        can be sent to a client instead of a snapshot; see `changes_since()`.
+        Changes are still observed for `resumeSeconds` after the last
+        observer leaves, so a client that reconnects within that time can
+        resume from where it left off.
+
+        With `incremental` set, the changes to the result are computed from
+        a copy of the joined tables kept in memory instead of queried from
+        the database, unless the query is not supported or the tables have
+        more than `incrementalMaxRecords` records; see `QueryView`.
     """
 
     def __init__(self, db, queryCfg):
         self.db = db
         self.query = query(db, queryCfg["joinspec"], queryCfg["fields"])
         self.eventManager = event_manager.event_manager()
+        self.aliases = [spec["alias"] for spec in queryCfg["joinspec"]]
         self.aliasByTable = {}
+        self.nullableAliases = set()
         self.rowsByTxnId = {}
+        self.changesByTxnId = {}
+        self.remoteTxnId = None
+        self.rollbackTxnId = None
+        self.changeLog = util.ChangeLog(queryCfg.get("changeLogSize", 1000))
+        self.seq = 0
+        self.notifyLock = asyncio.Lock()
+        self.resumeSeconds = queryCfg.get("resumeSeconds", 60)
+        self.unobserveTask = None
         self.schema = []
+        self.cache = None
+        self.view = None
+        self.loadTask = None
+        self.isObserving = False
+        self.queryName = queryCfg.get("queryName")
+
+        # Incremental view maintenance
+        if queryCfg.get("incremental", False):
+            if query_view.QueryView.supports(queryCfg["joinspec"], queryCfg["fields"], db.cfg["typesByField"]):
+                self.view = query_view.QueryView(db, queryCfg["joinspec"], queryCfg["fields"], queryCfg.get("incrementalMaxRecords", 100000))
+            else:
+                debug.warning(f"{self.queryName}: Query cannot be maintained incrementally, using the database instead")
+
+        # Snapshot cache (requires named fields to sort the cached rows by)
+        cacheMaxRows = queryCfg.get("cacheMaxRows", 10000)
+
+        if cacheMaxRows and queryCfg["fields"]:
+            self.cache = query_cache.QueryCache(self, self.query.sortfields, cacheMaxRows)
 
         # Schema
         for spec in queryCfg["fields"]:
@@ -301,21 +510,169 @@ class QueryData:
 
             self.aliasByTable[table] += [alias]
 
-        # Observe changes to key tables
-        for table in self.aliasByTable.keys():
-            self.db.on("insert", table, self.__on_txn)
-            self.db.on("update", table, self.__on_txn)
-            self.db.on("delete", table, self.__on_txn)
-            self.db.on("preinsert", table, self.__on_pretxn)
-            self.db.on("preupdate", table, self.__on_pretxn)
-            self.db.on("predelete", table, self.__on_pretxn)
+        # Aliases that may be NULL in a result row: the left joined ones, or
+        # any but the first if the joins are not all inner or left joins
+        joinTypes = [query_view.JOINTYPES.get(" ".join(spec.get("joinType", "inner").lower().split())) for spec in queryCfg["joinspec"][1:]]
+
+        for spec, joinType in zip(queryCfg["joinspec"][1:], joinTypes):
+            if joinType != "inner" or None in joinTypes:
+                self.nullableAliases.add(spec["alias"])
 
     def on(self, type, handler):
         self.eventManager.on(type, handler)
+        self.__observe()
+
+        if self.unobserveTask:
+            self.unobserveTask.cancel()
+            self.unobserveTask = None
 
     def off(self, type, handler):
         self.eventManager.off(type, handler)
 
+        if self.eventManager.handlersByType:
+            return
+
+        if not self.resumeSeconds:
+            self.__unobserve()
+
+        elif not self.unobserveTask:
+            self.unobserveTask = asyncio.create_task(self.__unobserve_later())
+
+    def is_shared(self):
+        """
+            Return True if changes are sent to more than one observer.
+        """
+        return len(self.eventManager.handlersByType.get("changes", ())) > 1
+
+    async def __unobserve_later(self):
+        await asyncio.sleep(self.resumeSeconds)
+
+        self.unobserveTask = None
+        self.__unobserve()
+
+    def __observe(self):
+        """
+            Observe changes to key tables.  Changes are only tracked while
+            there is at least one observer of this query data.
+        """
+        if not self.isObserving:
+            for table in self.aliasByTable.keys():
+                self.db.on("insert", table, self.__on_txn)
+                self.db.on("update", table, self.__on_txn)
+                self.db.on("delete", table, self.__on_txn)
+                self.db.on("preinsert", table, self.__on_pretxn)
+                self.db.on("preupdate", table, self.__on_pretxn)
+                self.db.on("predelete", table, self.__on_pretxn)
+                self.db.on("reload", table, self.__on_reload)
+                self.db.on("rollback", table, self.__on_rollback)
+                self.db.on("prebatch", table, self.__on_prebatch)
+                self.db.on("batch", table, self.__on_batch)
+
+            # Changes from other workers arrive already committed, so the view
+            # must be loaded before them
+            if self.view and self.db.peers:
+                self.loadTask = asyncio.create_task(self.__preload_view())
+
+            # The changes made while not observing are not in the change log
+            changes = self.db.changeLog.since(self.seq)
+
+            if changes is None or any(change["table"] in self.aliasByTable for seq, change in changes):
+                self.__restart_log(self.db.seq)
+
+            self.isObserving = True
+
+    async def __preload_view(self):
+        try:
+            await self.__load_view()
+
+        except Exception as e:
+            debug.error("QueryData.__preload_view()", str(e))
+
+    async def __load_view(self):
+        """
+            Load the view if there is one, and return True if it is in use.
+            A view whose tables have too many records is dropped, and the
+            database is used instead.
+        """
+        view = self.view
+
+        if not view:
+            return False
+
+        if not await view.load():
+            debug.warning(f"{self.queryName}: Query tables have more than {view.maxRecords} records, using the database instead")
+
+            if self.view is view:
+                self.view = None
+
+            return False
+
+        return True
+
+    def __unobserve(self):
+        """
+            Stop observing changes to key tables.  Anything derived from the
+            changes is discarded since it can no longer be kept current.
+        """
+        if self.isObserving:
+            for table in self.aliasByTable.keys():
+                self.db.off("insert", table, self.__on_txn)
+                self.db.off("update", table, self.__on_txn)
+                self.db.off("delete", table, self.__on_txn)
+                self.db.off("preinsert", table, self.__on_pretxn)
+                self.db.off("preupdate", table, self.__on_pretxn)
+                self.db.off("predelete", table, self.__on_pretxn)
+                self.db.off("reload", table, self.__on_reload)
+                self.db.off("rollback", table, self.__on_rollback)
+                self.db.off("prebatch", table, self.__on_prebatch)
+                self.db.off("batch", table, self.__on_batch)
+
+            if self.cache:
+                self.cache.clear()
+
+            if self.loadTask:
+                self.loadTask.cancel()
+                self.loadTask = None
+
+            if self.view:
+                self.view.unload()
+
+            self.rowsByTxnId = {}
+            self.changesByTxnId = {}
+            self.isObserving = False
+
+    async def snapshot(self, lastrow={}, maxcount=""):
+        """
+            Return the rows after `lastrow`, up to `maxcount` rows.  The rows
+            are served from the cache if possible, from the database
+            otherwise.
+        """
+        rows = self.cache.page(lastrow, maxcount) if self.cache else None
+
+        if rows is None:
+            async for row in self.rows(lastrow=lastrow, maxcount=maxcount):
+                yield row
+        else:
+            for row in rows:
+                yield row
+
+    async def rows(self, **kwargs):
+        """
+            Query the database for rows.  The rows are shared by all observers
+            so each row is only encoded once no matter how many sessions it is
+            sent to.
+        """
+        async for rows in self.batches(**kwargs):
+            for row in rows:
+                yield row
+
+    async def batches(self, **kwargs):
+        """
+            Same as rows(), but yield the rows in batches.
+        """
+        async for rows in self.query.batches(rowType=json_codec.json_record, **kwargs):
+            yield rows
+
     async def __on_pretxn(self, event):
         """
             Before committing a txn, get the list of possible rows that will be
@@ -325,7 +682,16 @@ class QueryData:
         txnId = event.get("txnId")
         table = event.get("table")
         record = event.get("record")
-        rows = await self.__rows_by_table(table, record)
+
+        # Changes of a transaction are handled by __on_prebatch()
+        if event.get("batchId"):
+            return
+
+        # The view only needs to be loaded before the first change
+        if await self.__load_view():
+            return
+
+        rows = await self.__rows_by_table(table, [self.__key(table, record)])
 
         self.rowsByTxnId[txnId] = rows
 
@@ -338,66 +704,460 @@ class QueryData:
         txnId = event.get("txnId")
         table = event.get("table")
         record = event.get("record")
-        oldrows = self.rowsByTxnId[txnId]
-        newrows = await self.__rows_by_table(table, record)
-        insert = []
-        delete = []
-        update = []
-        tasks = []
+
+        # Changes of a transaction are handled by __on_batch()
+        if event.get("batchId"):
+            return
+
+        # Notify in the order of the changes, as numbered by the database
+        async with self.notifyLock:
+            if self.view and self.view.isLoaded:
+                (oldrows, newrows) = self.view.apply(event.get("operation"), table, event.get("rowId"), record)
+            elif not self.view and txnId in self.rowsByTxnId:
+                oldrows = self.rowsByTxnId.pop(txnId)
+                newrows = await self.__rows_by_table(table, [self.__key(table, record)])
+            else:
+                # Started observing after this txn began
+                self.__restart_log(event["seq"])
+                return
+
+            await self.__notify(oldrows, newrows, event["seq"])
+
+    async def __on_prebatch(self, event):
+        """
+            Same as __on_pretxn(), but for all changes of a transaction.  The
+            event is triggered once per table changed by the transaction so
+            only the first one is handled.
+        """
+        txnId = event.get("txnId")
+        changesByTable = event.get("changesByTable")
+
+        if txnId in self.changesByTxnId:
+            return
+
+        self.changesByTxnId[txnId] = changesByTable
+
+        if not await self.__load_view():
+            self.rowsByTxnId[txnId] = await self.__rows_by_changes(changesByTable)
+
+    async def __on_batch(self, event):
+        """
+            Same as __on_txn(), but for all changes of a transaction.  Rows
+            changed more than once by the transaction are only notified once,
+            comparing them before and after the whole transaction.
+        """
+        async with self.notifyLock:
+            await self.__handle_batch(event)
+
+    async def __handle_batch(self, event):
+        txnId = event.get("txnId")
+        changesByTable = event.get("changesByTable")
+        seq = event.get("seq")
+
+        if event.get("remote"):
+            await self.__on_remote_batch(event)
+            return
+
+        if txnId not in self.changesByTxnId:
+            # Already handled, or started observing after this txn began
+            if seq and seq > self.seq:
+                self.__restart_log(seq)
+
+            return
+
+        requestsByTable = self.changesByTxnId.pop(txnId)
+        oldrows = self.rowsByTxnId.pop(txnId, {})
+
+        if self.view and self.view.isLoaded:
+            newrows = self.__apply_view(changesByTable, oldrows)
+        elif not self.view:
+            # Also look up the records that were not changed, as before
+            newrows = await self.__rows_by_changes(requestsByTable, changesByTable)
+        else:
+            if seq:
+                self.__restart_log(seq)
+
+            return
+
+        await self.__notify(oldrows, newrows, seq)
+
+    async def __on_remote_batch(self, event):
+        """
+            Same as __on_batch(), but for the changes of a transaction
+            committed by another worker.
+        """
+        txnId = event.get("txnId")
+
+        if txnId == self.remoteTxnId:
+            return
+
+        self.remoteTxnId = txnId
+
+        # Wait for the view being loaded since observing began, if any
+        if self.loadTask:
+            await asyncio.wait([self.loadTask])
+            self.loadTask = None
+
+        # The records before the changes were sent along with them
+        changesByTable = event.get("changesByTable")
+        oldsByTable = {}
+
+        for table, changes in changesByTable.items():
+            olds = oldsByTable.setdefault(table, {})
+
+            for change in changes:
+                olds.setdefault(change["rowId"], change.get("old"))
+
+        await self.__reconcile(changesByTable, event.get("seq"), oldsByTable)
+
+    async def __on_rollback(self, event):
+        """
+            A transaction was rolled back after the events of its changes
+            were triggered.  The changes of a transaction whose "batch"
+            event never came were not notified, so they are forgotten; the
+            rows of the others are notified again as they are now.  The
+            event is triggered once per table rolled back so only the first
+            one is handled.
+        """
+        txnId = event.get("txnId")
+
+        async with self.notifyLock:
+            if txnId == self.rollbackTxnId:
+                return
+
+            self.rollbackTxnId = txnId
+
+            if txnId in self.changesByTxnId:
+                del self.changesByTxnId[txnId]
+                self.rowsByTxnId.pop(txnId, None)
+                return
+
+            # The records were notified as the changes left them
+            changesByTable = event.get("changesByTable")
+            oldsByTable = {}
+
+            for table, changes in changesByTable.items():
+                olds = oldsByTable.setdefault(table, {})
+
+                for change in changes:
+                    olds[change["rowId"]] = change["record"] if change["operation"] != "delete" else None
+
+            await self.__reconcile(changesByTable, event.get("seq"), oldsByTable)
+
+    async def __reconcile(self, changesByTable, seq, oldsByTable):
+        """
+            Notify the result rows of changes whose pre events were not
+            handled, i.e., another worker's or rolled back ones.  The rows
+            before the changes can no longer be read from the database, so
+            they come from the view, or failing that, from the database with
+            the changed records replaced by `oldsByTable`, their records
+            before the changes (None if there was none) keyed by the table
+            and the rowid.  Rows the cache covers are taken from the cache
+            instead, which has them as they were last notified even if the
+            other tables of the query have changed since.
+
+            Workers' changes may arrive in a different order than they were
+            committed, so the view is given the changed records as they are
+            now rather than as they were changed.
+        """
+        if self.view and self.view.isLoaded:
+            oldrows = {}
+            newrows = self.__apply_view(await self.__current_changes(changesByTable), oldrows)
+        else:
+            oldrows = await self.__rows_by_changes(changesByTable, sources=self.__sources(oldsByTable))
+
+            # Rows the cache covers are as they were last notified
+            if self.cache:
+                oldrows = { rowid: row for rowid, row in oldrows.items() if not self.cache.covers(row) }
+                oldrows.update(self.__cached_rows(changesByTable))
+            newrows = await self.__rows_by_changes(changesByTable)
+
+            # The view may have been loading while the changes were made
+            if await self.__load_view():
+                self.__apply_view(await self.__current_changes(changesByTable), {})
+
+        await self.__notify(oldrows, newrows, seq)
+
+    def __apply_view(self, changesByTable, oldrows):
+        """
+            Apply the changes of a transaction to the view.  Add the result
+            rows from before the changes to `oldrows`, unless already there,
+            and return the rows after the changes, each keyed by the rowid.
+        """
+        newrows = {}
+
+        for table, changes in changesByTable.items():
+            if table not in self.aliasByTable:
+                continue
+
+            for change in changes:
+                (before, after) = self.view.apply(change["operation"], table, change["rowId"], change["record"])
+
+                for rowid in {**before, **after}:
+                    if rowid not in newrows and rowid in before:
+                        oldrows[rowid] = before[rowid]
+
+                    newrows[rowid] = after.get(rowid)
+
+        return { rowid: row for rowid, row in newrows.items() if row is not None }
+
+    async def __current_changes(self, changesByTable):
+        """
+            Return the changes of the tables of the query with each record
+            replaced by its current version, or deleted if it no longer
+            exists.
+        """
+        currentByTable = {}
+
+        for table, changes in changesByTable.items():
+            if table not in self.aliasByTable:
+                continue
+
+            rowIds = list({ change["rowId"] : True for change in changes })
+            recordByRowId = {}
+
+            for i in range(0, len(rowIds), MAX_KEYS):
+                chunk = rowIds[i:i+MAX_KEYS]
+                sqlstmt = f'rowid as "__rowid__", * from {table} where rowid in ({", ".join(["?"] * len(chunk))})'
+
+                async for record in self.db.select(sqlstmt, chunk, writer=True):
+                    recordByRowId[record["__rowid__"]] = record
+
+            currentByTable[table] = [{
+                "operation" : "update" if rowId in recordByRowId else "delete",
+                "record"    : recordByRowId.get(rowId, {}),
+                "rowId"     : rowId,
+            } for rowId in rowIds]
+
+        return currentByTable
+
+    def __sources(self, oldsByTable):
+        """
+            Return the select of each table of the query with the records of
+            `oldsByTable` in place of the current ones, as the `sources` of
+            the query.  The records are bound as one JSON argument so any
+            number of them fits in one select.
+        """
+        sources = {}
+
+        for table, olds in oldsByTable.items():
+            if table not in self.aliasByTable:
+                continue
+
+            fields = self.db.cfg["fieldsByTable"][table]
+            records = [[rowId] + [old.get(field) for field in fields] for rowId, old in olds.items() if old is not None]
+            columns = ", ".join(f"json_extract(value, '$[{i + 1}]')" for i in range(len(fields)))
+
+            sources[table] = (f"""
+                select rowid as "rowid", { ", ".join(fields) } from main.{table}
+                where rowid not in (select value from json_each(?))
+                union all
+                select json_extract(value, '$[0]'), {columns} from json_each(?)
+            """, [json.dumps(list(olds)), json.dumps(records)])
+
+        return sources
+
+    def __cached_rows(self, changesByTable):
+        """
+            Return the cached result rows that include any of the changed
+            records, or the absence of a record that may be NULL, keyed by
+            the rowid.
+        """
+        rows = {}
+
+        if not self.cache or not self.cache.isWarm:
+            return rows
+
+        for table, changes in changesByTable.items():
+            for alias in self.aliasByTable.get(table, []):
+                rowIds = set(str(change["rowId"]) for change in changes)
+
+                if alias in self.nullableAliases:
+                    rowIds.add("0")
+
+                rows.update(self.cache.rows_by_part(self.aliases.index(alias), rowIds))
+
+        return rows
+
+    async def __notify(self, oldrows, newrows, seq):
+        """
+            Log and notify the observers of the difference between the result
+            rows before and after the change numbered `seq`, each keyed by the
+            rowid.  The observers are given all of the difference at once.
+        """
+        changes = []
 
         for rowid,row in oldrows.items():
             if rowid not in newrows:
-                tasks += [self.eventManager.trigger({
-                    "type" : "delete",
-                    "row"  : row,
-                })]
+                if self.cache:
+                    self.cache.apply("delete", row)
+
+                changes += [{
+                    "operation" : "delete",
+                    "row"       : row,
+                }]
 
         for rowid,row in newrows.items():
             if rowid not in oldrows:
-                tasks += [self.eventManager.trigger({
-                    "type" : "insert",
-                    "row"  : row,
-                })]
+                if self.cache:
+                    self.cache.apply("insert", row)
+
+                changes += [{
+                    "operation" : "insert",
+                    "row"       : row,
+                }]
             elif rowid in newrows and oldrows[rowid] != newrows[rowid]:
-                tasks += [self.eventManager.trigger({
-                    "type" : "update",
-                    "row"  : row,
-                })]
+                if self.cache:
+                    self.cache.apply("update", row)
+
+                changes += [{
+                    "operation" : "update",
+                    "row"       : row,
+                }]
+
+        # A transaction that changed nothing has no seq
+        if seq is not None:
+            self.seq = max(self.seq, seq)
+
+            for change in changes:
+                self.changeLog.append(seq, change)
+
+        if changes:
+            await self.eventManager.trigger({
+                "type"    : "changes",
+                "changes" : changes,
+                "seq"     : seq,
+            })
 
-        if tasks:
-            await asyncio.gather(*tasks)
+        # The same changes one row at a time, for observers of those
+        if any(type in self.eventManager.handlersByType for type in ("insert", "update", "delete")):
+            for change in changes:
+                await self.eventManager.trigger({
+                    "type" : change["operation"],
+                    "row"  : change["row"],
+                    "seq"  : seq,
+                })
+
+    def changes_since(self, seq):
+        """
+            Return the (seq, change) of each change to the result since the
+            change numbered `seq`, or None if they are not all in the change
+            log.
+        """
+        if seq > self.seq:
+            return None
+
+        return self.changeLog.since(seq)
+
+    def __restart_log(self, seq):
+        """
+            Empty the change log.  The changes to the result up to the change
+            numbered `seq` are unknown.
+        """
+        self.seq = max(self.seq, seq)
+        self.changeLog.clear(self.seq)
+
+    async def __on_reload(self, event):
+        """
+            A table was bulk loaded without per-record events.  Discard
+            anything derived from the table; it is rebuilt on demand.  The
+            observers are notified by a "reload" event, since the changes to
+            the result are unknown.
+        """
+        async with self.notifyLock:
+            if self.cache:
+                self.cache.clear()
+
+            if self.view:
+                self.view.unload()
+
+            self.__restart_log(event["seq"])
+
+        await self.eventManager.trigger({
+            "type" : "reload",
+            "seq"  : self.seq,
+        })
+
+    async def __rows_by_changes(self, *changesByTables, sources={}):
+        """
+            Return the query result rows that include any of the records of
+            one or more `changesByTable` or their absence, keyed by the rowid.
+            The tables in `sources` are read from them instead, as by
+            Query.statement().
+        """
+        keysByTable = {}
+        rows = {}
+
+        for changesByTable in changesByTables:
+            for table, changes in changesByTable.items():
+                if table in self.aliasByTable:
+                    keys = keysByTable.setdefault(table, {})
+
+                    for change in changes:
+                        keys[self.__key(table, change["record"])] = True
+
+        for table, keys in keysByTable.items():
+            keys = list(keys)
+
+            for i in range(0, len(keys), MAX_KEYS):
+                rows.update(await self.__rows_by_table(table, keys[i:i+MAX_KEYS], sources))
 
-        del self.rowsByTxnId[txnId]
+        return rows
+
+    def __key(self, table, record):
+        return tuple(record.get(keyfield, 0) for keyfield in self.db.keyfields(table))
 
-    async def __rows_by_table(self, table, record):
+    async def __rows_by_table(self, table, keys, sources={}):
         """
-            Return the query result rows that include a record or its absence.
-            The return result is keyed by the rowid.
+            Return the query result rows that include any of the records of a
+            table with `keys`, or their absence.  The return result is keyed by
+            the rowid.
+        """
+        (where, args) = self.keyed_where(table, keys)
+        rows = {}
+
+        # Read on the writer to see the changes of the txn before it commits
+        async for batch in self.batches(where=where, args=args, writer=True, sources=sources):
+            for row in batch:
+                rows[row["__rowid__"]] = row
+
+        return rows
+
+    def keyed_where(self, table, keys):
         """
+            Return the where clause and arguments that select the query result
+            rows that include any of the records of a table with `keys`, or
+            their absence.
+        """
+        keyfields = self.db.keyfields(table)
         where = []
         args = []
-        rows = {}
+
+        # The keys are bound as one JSON array so the SQL is the same however
+        # many keys there are, and is compiled only once
+        if len(keyfields) == 1:
+            values = "select value from json_each(?)"
+            keysJson = json.dumps([key[0] for key in keys], default=str)
+        else:
+            values = "select " + ", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(keyfields))) + " from json_each(?)"
+            keysJson = json.dumps([list(key) for key in keys], default=str)
 
         # Filer rules
         for alias in self.aliasByTable[table]:
-            awhere = []
-            nwhere = []
-
-            for keyfield in self.db.keyfields(table):
-                awhere += [ f"{alias}.{keyfield} = ?" ]
-                nwhere += [ f"{alias}.{keyfield} is NULL" ]
-                args += [ record.get(keyfield, 0) ]
+            if len(keyfields) == 1:
+                awhere = f"{alias}.{keyfields[0]} in ({values})"
+            else:
+                columns = ", ".join(f"{alias}.{keyfield}" for keyfield in keyfields)
+                awhere = f"({columns}) in ({values})"
 
-            where += [
-                f"( {' and '.join(awhere)} )",
-                f"( {' and '.join(nwhere)} )",
-            ]
+            args += [ keysJson ]
+            where += [ f"( {awhere} )" ]
 
-        async for row in self.query(where=" or ".join(where), args=args):
-            rowid = row["__rowid__"]
-            rows[rowid] = row
+            # Rows without the alias are affected if it may be NULL
+            if alias in self.nullableAliases:
+                where += [ f"( {' and '.join(f'{alias}.{keyfield} is NULL' for keyfield in keyfields)} )" ]
 
-        return rows
+        return (" or ".join(where), args)
 
 
 ##############################################################################
@@ -0,0 +1,351 @@
+import re
+import asyncio
+from . import debug
+from . import json_codec
+
+
+##############################################################################
+# GLOBALS
+
+COLUMN_RE = re.compile(r"^\s*(\w+)\.(\w+)\s*$")
+EQUALS_RE = re.compile(r"^\s*(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\s*$")
+COLLATE_RE = re.compile(r"\bcollate\s+(?!binary\b)\w+", re.IGNORECASE)
+JOINTYPES = {
+    "inner"      : "inner",
+    "left"       : "left",
+    "left outer" : "left",
+}
+
+
+##############################################################################
+# AFFINITY
+
+def affinity(fieldType):
+    """
+        Return the SQLite affinity of a declared column type, as "text",
+        "blob", or "numeric" (for INTEGER, REAL and NUMERIC, which compare
+        alike).
+    """
+    fieldType = fieldType.lower()
+
+    if   "int" in fieldType  : return "numeric"
+    elif "char" in fieldType : return "text"
+    elif "clob" in fieldType : return "text"
+    elif "text" in fieldType : return "text"
+    elif "blob" in fieldType : return "blob"
+    elif not fieldType       : return "blob"
+    else                     : return "numeric"
+
+
+##############################################################################
+# QUERY VIEW
+
+class QueryView:
+    """
+        Incrementally maintain the result of a query in memory.
+
+        A copy of every joined table is kept in memory, along with hash
+        indexes on the columns used by the join conditions, so the result
+        rows affected by a change to a record can be computed directly from
+        the record without querying the database.  Memory use is therefore
+        proportional to the size of the joined tables, not of the result.
+        `load()` gives up if the tables have more than `maxRecords` records
+        in all; once loaded, the view grows with the tables until unloaded.
+
+        Only queries whose join conditions are equalities between columns
+        (`a.X = b.Y [and ...]`) that compare the same in Python as in
+        SQLite, whose fields are plain columns (`a.X`), and that have no
+        filters or arguments can be maintained this way; use
+        `QueryView.supports()` to check.
+    """
+
+    def __init__(self, db, joinspec, fieldspec, maxRecords=100000):
+        self.db = db
+        self.maxRecords = maxRecords
+        self.aliases = []
+        self.tableByAlias = {}
+        self.joinTypeByAlias = {}
+        self.conditionsByAlias = {}
+        self.fields = []
+        self.recordsByTable = {}
+        self.indexesByTable = {}
+        self.isLoaded = False
+        self.loadLock = asyncio.Lock()
+
+        # Joins
+        for spec in joinspec:
+            alias = spec["alias"]
+            table = spec["table"]
+
+            self.aliases += [alias]
+            self.tableByAlias[alias] = table
+            self.joinTypeByAlias[alias] = JOINTYPES[" ".join(spec.get("joinType", "inner").lower().split())]
+            self.conditionsByAlias[alias] = []
+            self.recordsByTable[table] = {}
+            self.indexesByTable[table] = {}
+
+        # Join conditions as (column, other alias, other column)
+        for spec in joinspec[1:]:
+            alias = spec["alias"]
+
+            for condition in re.split(r"\s+and\s+", spec["joinOn"], flags=re.IGNORECASE):
+                (a1, c1, a2, c2) = EQUALS_RE.match(condition).groups()
+
+                if a1 != alias:
+                    (a1, c1, a2, c2) = (a2, c2, a1, c1)
+
+                self.conditionsByAlias[alias] += [(c1, a2, c2)]
+                self.indexesByTable[self.tableByAlias[a1]][c1] = {}
+                self.indexesByTable[self.tableByAlias[a2]][c2] = {}
+
+        # Fields as (name, alias, column)
+        for spec in fieldspec:
+            (alias, column) = COLUMN_RE.match(spec["source"]).groups()
+
+            self.fields += [(spec["name"], alias, column)]
+
+    @staticmethod
+    def supports(joinspec, fieldspec, typesByField):
+        """
+            Return True if a query can be maintained incrementally.  The
+            columns of each join condition must have the same affinity and
+            no collation but BINARY (according to their types in
+            `typesByField`), since SQLite would otherwise convert or fold
+            the values it compares, and the view compares them as they are.
+        """
+        aliases = []
+
+        if not fieldspec:
+            return False
+
+        for i, spec in enumerate(joinspec):
+            alias = spec["alias"]
+            hasEarlier = False
+
+            if "where" in spec or spec.get("args"):
+                return False
+
+            if " ".join(spec.get("joinType", "inner").lower().split()) not in JOINTYPES:
+                return False
+
+            # Every join must be on columns, and on at least one earlier alias
+            if i > 0:
+                for condition in re.split(r"\s+and\s+", spec.get("joinOn", ""), flags=re.IGNORECASE):
+                    match = EQUALS_RE.match(condition)
+
+                    if not match:
+                        return False
+
+                    (a1, c1, a2, c2) = match.groups()
+
+                    if alias not in (a1, a2) or a1 == a2:
+                        return False
+
+                    if (a2 if a1 == alias else a1) not in aliases:
+                        return False
+
+                    (t1, t2) = (typesByField.get(c1), typesByField.get(c2))
+
+                    if t1 is None or t2 is None or affinity(t1) != affinity(t2):
+                        return False
+
+                    if COLLATE_RE.search(t1) or COLLATE_RE.search(t2):
+                        return False
+
+                    hasEarlier = True
+
+                if not hasEarlier:
+                    return False
+
+            aliases += [alias]
+
+        for spec in fieldspec:
+            match = COLUMN_RE.match(spec["source"])
+
+            if not match or match.group(1) not in aliases:
+                return False
+
+        return True
+
+    async def load(self):
+        """
+            Load the joined tables into memory if they aren't already.  This
+            must complete before the first change to any of the tables.
+            Return False, leaving the view unloaded, if the tables have more
+            than `maxRecords` records.
+        """
+        async with self.loadLock:
+            if not self.isLoaded:
+                count = 0
+
+                for table in self.recordsByTable.keys():
+                    self.__clear(table)
+
+                    async for record in self.db.select(f'rowid as "__rowid__", * from {table}', writer=True):
+                        self.__set(table, record["__rowid__"], record)
+                        count += 1
+
+                        if count > self.maxRecords:
+                            self.unload()
+                            return False
+
+                self.isLoaded = True
+
+            return True
+
+    def unload(self):
+        """
+            Release the in-memory tables.  They are reloaded by the next call
+            to `load()`.
+        """
+        for table in self.recordsByTable.keys():
+            self.__clear(table)
+
+        self.isLoaded = False
+
+    def __clear(self, table):
+        self.recordsByTable[table] = {}
+
+        for column in self.indexesByTable[table].keys():
+            self.indexesByTable[table][column] = {}
+
+    def __set(self, table, rowid, record):
+        """
+            Replace the record at `rowid` (or remove it if `record` is None)
+            and return the record it replaced.
+        """
+        records = self.recordsByTable[table]
+        indexes = self.indexesByTable[table]
+        old = records.pop(rowid, None)
+
+        for column, index in indexes.items():
+            if old is not None and old.get(column) is not None:
+                rowids = index[old[column]]
+                rowids.discard(rowid)
+
+                if not rowids:
+                    del index[old[column]]
+
+            if record is not None and record.get(column) is not None:
+                index.setdefault(record[column], set()).add(rowid)
+
+        if record is not None:
+            records[rowid] = record
+
+        return old
+
+    def __roots(self, alias, rowid, record):
+        """
+            Return the rowids of the first table's records whose result rows
+            may include `record` as `alias`.
+        """
+        conditions = self.conditionsByAlias[alias]
+
+        if alias == self.aliases[0]:
+            return { rowid }
+
+        (column, other, ocolumn) = conditions[0]
+        otable = self.tableByAlias[other]
+        roots = set()
+
+        for orowid in self.indexesByTable[otable][ocolumn].get(record.get(column), ()):
+            roots |= self.__roots(other, orowid, self.recordsByTable[otable][orowid])
+
+        return roots
+
+    def __matches(self, alias, bound):
+        """
+            Return the (rowid, record) pairs of `alias` that satisfy its join
+            conditions against the aliases bound so far.
+        """
+        table = self.tableByAlias[alias]
+        records = self.recordsByTable[table]
+        conditions = self.conditionsByAlias[alias]
+        matches = []
+
+        # A join against NULL never matches
+        for (column, other, ocolumn) in conditions:
+            if bound[other] is None or bound[other][1].get(ocolumn) is None:
+                return []
+
+        (column, other, ocolumn) = conditions[0]
+        value = bound[other][1][ocolumn]
+
+        for rowid in self.indexesByTable[table][column].get(value, ()):
+            record = records[rowid]
+
+            if all(record.get(c) == bound[o][1][oc] for (c, o, oc) in conditions[1:]):
+                matches += [(rowid, record)]
+
+        return matches
+
+    def __rows(self, roots):
+        """
+            Return the result rows for a set of first table rowids, keyed by
+            the result rowid.
+        """
+        first = self.aliases[0]
+        records = self.recordsByTable[self.tableByAlias[first]]
+        rows = {}
+
+        for rootid in roots:
+            if rootid not in records:
+                continue
+
+            partials = [{ first : (rootid, records[rootid]) }]
+
+            for alias in self.aliases[1:]:
+                extended = []
+
+                for bound in partials:
+                    matches = self.__matches(alias, bound)
+
+                    if matches:
+                        extended += [bound | { alias : match } for match in matches]
+                    elif self.joinTypeByAlias[alias] == "left":
+                        extended += [bound | { alias : None }]
+
+                partials = extended
+
+            for bound in partials:
+                row = {
+                    "__rowid__" : "|".join(str(bound[a][0]) if bound[a] else "0" for a in self.aliases),
+                }
+
+                for (name, alias, column) in self.fields:
+                    row[name] = bound[alias][1].get(column) if bound[alias] else None
+
+                rows[row["__rowid__"]] = json_codec.json_record(row)
+
+        return rows
+
+    def apply(self, operation, table, rowid, record):
+        """
+            Apply a change to a record and return the affected result rows
+            before and after the change, each keyed by the result rowid.
+        """
+        new = record if operation != "delete" else None
+        old = self.__set(table, rowid, new)
+        roots = set()
+
+        # Result rows that may include the new record
+        if new is not None:
+            for alias in self.aliases:
+                if self.tableByAlias[alias] == table:
+                    roots |= self.__roots(alias, rowid, new)
+
+        # Result rows that may have included the old record
+        self.__set(table, rowid, old)
+
+        if old is not None:
+            for alias in self.aliases:
+                if self.tableByAlias[alias] == table:
+                    roots |= self.__roots(alias, rowid, old)
+
+        oldrows = self.__rows(roots)
+        self.__set(table, rowid, new)
+        newrows = self.__rows(roots)
+
+        debug.database("QueryView.apply", operation, table, rowid, len(oldrows), len(newrows))
+
+        return (oldrows, newrows)
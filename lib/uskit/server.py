@@ -1,11 +1,14 @@
 import os
+import time
 import asyncio
 import tornado.web
 import tornado.websocket
 from . import util
 from . import debug
 from . import session
+from . import json_codec
 from . import event_manager
+from .workers import Peers
 
 
 ##############################################################################
@@ -17,7 +20,17 @@ class Server:
         self.staticdir = kwargs.get("staticdir", os.path.join(util.SCRIPTDIR, "static"))
         self.uskitStatic = kwargs.get("uskit-static", "/uskit")
         self.uskitStaticdir = kwargs.get("uskit-staticdir", os.path.join(util.MODULEDIR, "static"))
+        self.codec = json_codec.json_codec(kwargs.get("codec", "json"))
+        self.codecBySubprotocol = { "uskit.json" : self.codec }
         self.servicesByPath = {}
+        self.outbound = kwargs.get("outbound")
+        self.compression = kwargs.get("compression")
+        self.compressionByPath = kwargs.get("compression-by-path", {})
+        self.compressionStatsByPath = {}
+
+        # MessagePack for clients that ask for it
+        if kwargs.get("msgpack", True) and json_codec.msgpack:
+            self.codecBySubprotocol["uskit.msgpack"] = json_codec.json_codec("msgpack")
 
     def on(self, path, service):
         if path not in self.servicesByPath:
@@ -27,7 +40,7 @@ class Server:
 
     def listen(self, port, host="localhost"):
         app = tornado.web.Application([
-            (f"/()"                    , UrlRedirectHandler           , {"target" : f"{self.static}/"}),
+            ("/()"                     , UrlRedirectHandler           , {"target" : f"{self.static}/"}),
             (f"{self.static}/()"       , tornado.web.StaticFileHandler, {"path" : os.path.join(self.staticdir, "index.html")}),
             (f"{self.static}/(.+)"     , tornado.web.StaticFileHandler, {"path" : self.staticdir}),
             (f"{self.uskitStatic}/(.+)", tornado.web.StaticFileHandler, {"path" : self.uskitStaticdir}),
@@ -35,17 +48,95 @@ class Server:
 
         debug.info(f"UserStaticPages at {self.static}")
         debug.info(f"UskitStaticPages at {self.uskitStatic}")
+        debug.info(f"JSON codec is {self.codec.name}")
+        debug.info(f"Subprotocols {', '.join(self.codecBySubprotocol.keys())}")
 
         # Add service routes
         for path, services in self.servicesByPath.items():
+            compression = self.__compression(path)
+            stats = self.compressionStatsByPath.setdefault(path, CompressionStats())
+
             debug.info(f"WebSocketHandler at {path}")
 
+            if compression:
+                debug.info(f"Compression at {path} is {compression}")
+
             app.add_handlers(".*", [
-                (path, WebSocketHandler, { "services": services })
+                (path, WebSocketHandler, {
+                    "services"           : services,
+                    "codec"              : self.codec,
+                    "codecBySubprotocol" : self.codecBySubprotocol,
+                    "outbound"           : self.outbound,
+                    "compression"        : compression,
+                    "compressionStats"   : stats,
+                })
             ])
 
+        # Workers share the port, and the kernel spreads connections across them
         debug.info(f"Listening on {host}:{port}")
-        app.listen(port, host)
+        app.listen(port, host, reuse_port=Peers.current is not None)
+
+    def compression_stats(self):
+        """
+            Return the compression statistics of each websocket path.
+        """
+        return { path : stats.asdict() for path, stats in self.compressionStatsByPath.items() }
+
+    def __compression(self, path):
+        """
+            Return the compression options for `path`, or None if websocket
+            compression is disabled at `path`.
+        """
+        compression = self.compressionByPath.get(path, self.compression)
+        options = {
+            "level"     : 6,
+            "mem-level" : 8,
+            "min-size"  : 1024,
+        }
+
+        if compression is None or compression is False:
+            return None
+
+        # Path options override server options
+        for overrides in (self.compression, compression):
+            if isinstance(overrides, dict):
+                util.dictmerge(options, overrides)
+
+        return options
+
+
+##############################################################################
+# COMPRESSION STATS
+
+class CompressionStats:
+    """
+        Websocket compression counters: the messages written and their size
+        (in characters for text, in bytes for binary), the same for those
+        written to connections that agreed to compression, and the time
+        spent writing those, which includes compressing them.
+    """
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.compressedMessages = 0
+        self.compressedBytes = 0
+        self.seconds = 0.0
+
+    def average_size(self):
+        return self.bytes / self.messages if self.messages else None
+
+    def asdict(self):
+        return {
+            "messages"           : self.messages,
+            "bytes"              : self.bytes,
+            "compressedMessages" : self.compressedMessages,
+            "compressedBytes"    : self.compressedBytes,
+            "averageSize"        : self.average_size(),
+            "seconds"            : self.seconds,
+        }
+
+    def __str__(self):
+        return f"{self.compressedMessages}/{self.messages} messages compressed, {self.compressedBytes} bytes in {self.seconds * 1000:.1f}ms"
 
 
 ##############################################################################
@@ -67,11 +158,15 @@ class UrlRedirectHandler(tornado.web.RequestHandler):
 
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     """
-        Route JSON messages to services that can handle them.
+        Route JSON (or MessagePack) messages to services that can handle them.
     """
-    def initialize(self, services):
+    def initialize(self, services, codec=None, codecBySubprotocol={}, outbound=None, compression=None, compressionStats=None):
         self.eventManager = event_manager.event_manager()
-        self.session = session.session(self)
+        self.session = session.session(self, codec, outbound)
+        self.codecBySubprotocol = codecBySubprotocol
+        self.compression = compression
+        self.compressionStats = compressionStats or CompressionStats()
+        self.isCompressed = False
         self.init_tasks = []
         event = {
             "type"    : "session",
@@ -85,6 +180,60 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
     def on(self, type, handler):
         self.eventManager.on(type, handler)
 
+    def select_subprotocol(self, subprotocols):
+        """
+            Use the first subprotocol requested by the client that we support
+            to select the wire format of the session.  JSON is used if the
+            client requests none.
+        """
+        for subprotocol in subprotocols:
+            if subprotocol in self.codecBySubprotocol:
+                self.session.codec = self.codecBySubprotocol[subprotocol]
+
+                return subprotocol
+
+        return None
+
+    def get_compression_options(self):
+        """
+            Offer compression if it is enabled at this path, unless the
+            messages written at this path so far are smaller than min-size
+            on average.
+        """
+        if self.compression is None:
+            return None
+
+        averageSize = self.compressionStats.average_size()
+
+        if averageSize is not None and averageSize < self.compression["min-size"]:
+            return None
+
+        # Tornado agrees to compression if the client asks for it
+        self.isCompressed = "permessage-deflate" in self.request.headers.get("Sec-WebSocket-Extensions", "")
+
+        return {
+            "compression_level" : self.compression["level"],
+            "mem_level"         : self.compression["mem-level"],
+        }
+
+    def write_message(self, message, binary=False):
+        stats = self.compressionStats
+
+        stats.messages += 1
+        stats.bytes += len(message)
+
+        if not self.isCompressed:
+            return super().write_message(message, binary)
+
+        start = time.perf_counter()
+        future = super().write_message(message, binary)
+
+        stats.seconds += time.perf_counter() - start
+        stats.compressedMessages += 1
+        stats.compressedBytes += len(message)
+
+        return future
+
     async def open(self):
         await asyncio.gather(*self.init_tasks)
         await self.eventManager.trigger({
@@ -92,6 +241,9 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
         })
 
     def on_close(self):
+        if self.compression is not None:
+            debug.socket(f"Compression at {self.request.path}: {self.compressionStats}")
+
         asyncio.create_task(self.eventManager.trigger({
             "type" : "close",
         }))
@@ -109,6 +261,30 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
 def server(**kwargs):
     """
         Create and return a uskit server object.
+
+        `codec` names the codec of JSON sessions: "json" (the default),
+        "orjson", "ujson", or "auto" for the fastest one installed.  See
+        `json_codec.json_codec()`.
+
+        Websocket compression (permessage-deflate) is enabled by passing
+        `compression=True` or a dict of options:
+
+            - "level": zlib compression level (default 6).
+            - "mem-level": zlib memory level (default 8).
+            - "min-size": compression is not offered to new connections
+              while the messages written at the path average fewer than
+              this many characters (bytes if binary), since compressing
+              them costs more than it saves (default 1024).
+
+        `compression-by-path` maps a websocket path to options that override
+        `compression` at that path, or to False to disable compression there,
+        e.g. `uskit.server(**{"compression-by-path": {"/chat": True}})`.
+        Compression statistics are returned by `compression_stats()`.
+
+        `outbound` sets the limits of each session's outbound queue and what
+        to do with a client too slow to keep up, e.g.
+        `{"max-messages": 1000, "max-bytes": 16777216, "policy": "conflate"}`.
+        See `Session` for the policies.
     """
     return Server(**kwargs)
 
@@ -1,8 +1,10 @@
 import json
 import asyncio
+import collections
 from . import util
 from . import debug
 from . import errors
+from . import json_codec
 from . import event_manager
 from tornado.websocket import WebSocketClosedError
 
@@ -11,15 +13,52 @@ from tornado.websocket import WebSocketClosedError
 # SESSION
 
 class Session:
+    """
+        Messages are sent through an outbound queue written to the websocket
+        by a writer task, so a slow client only holds up the senders to that
+        client.  If the queue reaches `max-messages` messages or `max-bytes`
+        bytes, the outbound `policy` decides what happens to the next message:
+
+            - "conflate": query updates are held and conflated by the query
+              until the queue drains; other messages block (default).
+            - "block": the sender waits until the queue drains.  Query
+              updates are sent while holding the query's lock, so one slow
+              client holds up the updates of every client of the query.
+            - "drop": the session is closed.
+
+        The queue has drained once it is under half of both limits.
+
+        A message that cannot be written to the websocket closes the session
+        and discards the rest of the queue.  The next send() raises
+        errors.SessionClosedError with the reason.
+    """
     sessionId = 0
 
-    def __init__(self, websocket):
+    def __init__(self, websocket, codec=None, outbound=None):
+        outbound = util.dictmerge({
+            "max-messages" : 1000,
+            "max-bytes"    : 16 * 1024 * 1024,
+            "policy"       : "conflate",
+        }, outbound or {})
+
         self.websocket = websocket
+        self.codec = codec or json_codec.json_codec()
         self.sessionId = Session.sessionId
         self.eventManager = event_manager.event_manager()
+        self.maxMessages = outbound["max-messages"]
+        self.maxBytes = outbound["max-bytes"]
+        self.policy = outbound["policy"]
+        self.queue = collections.deque()
+        self.queueBytes = 0
+        self.writerTask = None
+        self.writeError = None
+        self.drainTasks = set()
+        self.drainEvent = asyncio.Event()
+        self.isClosed = False
 
         Session.sessionId += 1
 
+        self.drainEvent.set()
         self.websocket.on("open", self.__on_open)
         self.websocket.on("close", self.__on_close)
         self.websocket.on("data", self.__on_data)
@@ -35,15 +74,17 @@ class Session:
     async def __on_close(self, event):
         debug.info(f"websocket closed (sessionId={self.sessionId})")
 
+        self.__closed()
+
         await self.eventManager.trigger(event)
 
     async def __on_data(self, event):
         data = event["data"]
 
         try:
-            message = json.loads(data)
+            message = self.codec.decode(data)
             type = message.get("MESSAGE_TYPE")
-            debug.socket(f"RX (sessionId={self.sessionId}):", json.dumps(message, indent=2, default=str))
+            debug.socket(f"RX (sessionId={self.sessionId}):", debug.lazy(lambda: json.dumps(message, indent=2, default=str)))
 
             count = await self.eventManager.trigger({
                 "type"    : type,
@@ -53,7 +94,7 @@ class Session:
             if count == 0:
                 await self.__on_nohandler(message)
 
-        except json.decoder.JSONDecodeError:
+        except errors.CodecError:
             debug.error(f"RX BAD (sessionId={self.sessionId}):", data)
             await self.__on_baddata(event)
 
@@ -81,24 +122,124 @@ class Session:
             },
         })
 
-    async def send(self, message):
+    def is_congested(self):
+        """
+            Return True if the outbound queue has reached its limit.
+        """
+        return len(self.queue) >= self.maxMessages or self.queueBytes >= self.maxBytes
+
+    def close(self):
+        """
+            Close the session.  Queued messages are discarded.
+        """
+        self.__closed()
+        self.websocket.close()
+
+    async def send(self, message, shared=False):
+        """
+            Queue a message to be sent.  Raise errors.SessionClosedError if the
+            session is closed, or is closed because the client is too slow.
+            `shared` is True if the rows in the message are also sent to other
+            sessions.
+        """
         message = message | {
             "TIMESTAMP" : util.nowstring(),
         }
 
+        # Slow consumer
+        while self.is_congested() and not self.isClosed:
+            if self.policy == "drop":
+                debug.warning(f"TX DROP (sessionId={self.sessionId}): {len(self.queue)} messages, {self.queueBytes} bytes queued")
+                self.close()
+            else:
+                await self.drainEvent.wait()
+
+        if self.isClosed:
+            debug.warning(f"TX FAIL (sessionId={self.sessionId})", debug.lazy(lambda: json.dumps(message, indent=2, default=str)))
+
+            if self.writeError:
+                raise errors.SessionClosedError(f"Session closed: {self.writeError}")
+
+            raise errors.SessionClosedError("Session closed")
+
         try:
-            await self.websocket.write_message(json.dumps(message, default=str))
-            debug.socket(f"TX (sessionId={self.sessionId}):", json.dumps(message, indent=2, default=str))
-        except WebSocketClosedError as e:
-            debug.warning(f"TX FAIL (sessionId={self.sessionId})", json.dumps(message, indent=2, default=str))
-            raise errors.SessionClosedError(str(e))
-        except e:
+            data = self.codec.encode(message, shared)
+        except Exception as e:
             raise errors.SessionError(str(e))
 
+        self.queue.append((data, self.codec.binary))
+        self.queueBytes += len(data)
+
+        if self.is_congested():
+            self.drainEvent.clear()
+
+        if not self.writerTask:
+            self.writerTask = asyncio.create_task(self.__write())
+
+        debug.socket(f"TX (sessionId={self.sessionId}):", debug.lazy(lambda: json.dumps(message, indent=2, default=str)))
+
+    async def __write(self):
+        """
+            Write queued messages to the websocket, one at a time, each once
+            the previous one has been written to the socket.
+        """
+        try:
+            while self.queue:
+                (data, binary) = self.queue[0]
+
+                await self.websocket.write_message(data, binary=binary)
+
+                self.queue.popleft()
+                self.queueBytes -= len(data)
+
+                # Drained
+                if not self.drainEvent.is_set() and len(self.queue) <= self.maxMessages // 2 and self.queueBytes <= self.maxBytes // 2:
+                    self.drainEvent.set()
+
+                    # Not awaited, since the handlers may send more
+                    drainTask = asyncio.create_task(self.eventManager.trigger({
+                        "type" : "drain",
+                    }))
+
+                    self.drainTasks.add(drainTask)
+                    drainTask.add_done_callback(self.__on_drained)
+
+        except WebSocketClosedError:
+            debug.warning(f"TX FAIL (sessionId={self.sessionId}): {len(self.queue)} messages discarded")
+            self.writeError = "Websocket closed"
+            self.__closed()
+
+        except Exception as e:
+            debug.error(f"TX FAIL (sessionId={self.sessionId}):", str(e))
+            self.writeError = str(e)
+            self.close()
+
+        finally:
+            self.writerTask = None
+
+    def __on_drained(self, drainTask):
+        self.drainTasks.discard(drainTask)
+
+        if not drainTask.cancelled() and drainTask.exception():
+            debug.error(f"DRAIN FAIL (sessionId={self.sessionId}):", str(drainTask.exception()))
+
+    def __closed(self):
+        """
+            Discard the outbound queue and wake up anyone waiting on it.
+        """
+        self.isClosed = True
+        self.queue.clear()
+        self.queueBytes = 0
+        self.drainEvent.set()
+
+        if self.writerTask and self.writerTask is not asyncio.current_task():
+            self.writerTask.cancel()
+            self.writerTask = None
+
 
 ##############################################################################
 # FACTORY
 
-def session(websocket):
-    return Session(websocket)
+def session(websocket, codec=None, outbound=None):
+    return Session(websocket, codec, outbound)
 
@@ -0,0 +1,236 @@
+/* ***************************************************************************
+* GLOBALS
+*/
+
+// Shared by every string encoded or decoded
+const TEXT_ENCODER = new TextEncoder();
+const TEXT_DECODER = new TextDecoder();
+
+
+/* ***************************************************************************
+* ENCODE
+*/
+
+/**
+* Encode a value as MessagePack.
+*
+* @returns {Uint8Array}  Encoded value.
+*/
+export function encode(value) {
+    const bytes = [];
+
+    pack(value, bytes);
+
+    return Uint8Array.from(bytes);
+}
+
+function pack(value, bytes) {
+    if(value === null || value === undefined) {
+        bytes.push(0xc0);
+    }
+    else if(value === false) {
+        bytes.push(0xc2);
+    }
+    else if(value === true) {
+        bytes.push(0xc3);
+    }
+    else if(typeof value == "number" && Number.isSafeInteger(value)) {
+        pack_int(value, bytes);
+    }
+    else if(typeof value == "number") {
+        const view = new DataView(new ArrayBuffer(8));
+
+        view.setFloat64(0, value);
+        bytes.push(0xcb, ...new Uint8Array(view.buffer));
+    }
+    else if(typeof value == "string") {
+        const data = TEXT_ENCODER.encode(value);
+
+        if     (data.length < 0x20)    bytes.push(0xa0 | data.length);
+        else if(data.length < 0x100)   bytes.push(0xd9, data.length);
+        else if(data.length < 0x10000) bytes.push(0xda, ...be(data.length, 2));
+        else                           bytes.push(0xdb, ...be(data.length, 4));
+
+        for(const b of data) bytes.push(b);
+    }
+    else if(value instanceof Uint8Array || value instanceof ArrayBuffer) {
+        const data = new Uint8Array(value);
+
+        if     (data.length < 0x100)   bytes.push(0xc4, data.length);
+        else if(data.length < 0x10000) bytes.push(0xc5, ...be(data.length, 2));
+        else                           bytes.push(0xc6, ...be(data.length, 4));
+
+        for(const b of data) bytes.push(b);
+    }
+    else if(Array.isArray(value)) {
+        if     (value.length < 0x10)    bytes.push(0x90 | value.length);
+        else if(value.length < 0x10000) bytes.push(0xdc, ...be(value.length, 2));
+        else                            bytes.push(0xdd, ...be(value.length, 4));
+
+        for(const v of value) pack(v, bytes);
+    }
+    else if(typeof value == "object") {
+        const entries = Object.entries(value).filter(([k, v]) => v !== undefined);
+
+        if     (entries.length < 0x10)    bytes.push(0x80 | entries.length);
+        else if(entries.length < 0x10000) bytes.push(0xde, ...be(entries.length, 2));
+        else                              bytes.push(0xdf, ...be(entries.length, 4));
+
+        for(const [k, v] of entries) {
+            pack(k, bytes);
+            pack(v, bytes);
+        }
+    }
+    else {
+        pack(String(value), bytes);
+    }
+}
+
+function pack_int(value, bytes) {
+    if     (value >= 0 && value < 0x80)         bytes.push(value);
+    else if(value < 0 && value >= -0x20)        bytes.push(value & 0xff);
+    else if(value >= 0 && value < 0x100)        bytes.push(0xcc, value);
+    else if(value >= 0 && value < 0x10000)      bytes.push(0xcd, ...be(value, 2));
+    else if(value >= 0 && value < 0x100000000)  bytes.push(0xce, ...be(value, 4));
+    else if(value >= -0x80 && value < 0)        bytes.push(0xd0, value & 0xff);
+    else if(value >= -0x8000 && value < 0)      bytes.push(0xd1, ...be(value, 2));
+    else if(value >= -0x80000000 && value < 0)  bytes.push(0xd2, ...be(value, 4));
+    else {
+        const view = new DataView(new ArrayBuffer(8));
+
+        if(value >= 0) { view.setBigUint64(0, BigInt(value)); bytes.push(0xcf); }
+        else           { view.setBigInt64(0, BigInt(value));  bytes.push(0xd3); }
+
+        bytes.push(...new Uint8Array(view.buffer));
+    }
+}
+
+function be(value, numbytes) {
+    const bytes = [];
+
+    for(let i=numbytes-1; i>=0; i--) {
+        bytes.push(Math.floor(value / 2**(8*i)) & 0xff);
+    }
+
+    return bytes;
+}
+
+
+/* ***************************************************************************
+* DECODE
+*/
+
+/**
+* Decode a MessagePack value.  Extension types are not supported.
+*
+* @returns {any}  Decoded value.
+*/
+export function decode(buffer) {
+    const data = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+    const reader = {
+        data   : data,
+        view   : new DataView(data.buffer, data.byteOffset, data.byteLength),
+        offset : 0,
+    };
+    const value = unpack(reader);
+
+    if(reader.offset != data.length) throw new SyntaxError("MessagePack: Extra data");
+
+    return value;
+}
+
+function unpack(r) {
+    const type = byte(r);
+
+    if(type < 0x80)  return type;
+    if(type < 0x90)  return unpack_map(r, type & 0x0f);
+    if(type < 0xa0)  return unpack_array(r, type & 0x0f);
+    if(type < 0xc0)  return unpack_str(r, type & 0x1f);
+    if(type >= 0xe0) return type - 0x100;
+
+    switch(type) {
+        case 0xc0 : return null;
+        case 0xc2 : return false;
+        case 0xc3 : return true;
+        case 0xc4 : return unpack_bin(r, uint(r, 1));
+        case 0xc5 : return unpack_bin(r, uint(r, 2));
+        case 0xc6 : return unpack_bin(r, uint(r, 4));
+        case 0xca : return read(r, 4, (v, o) => v.getFloat32(o));
+        case 0xcb : return read(r, 8, (v, o) => v.getFloat64(o));
+        case 0xcc : return uint(r, 1);
+        case 0xcd : return uint(r, 2);
+        case 0xce : return uint(r, 4);
+        case 0xcf : return Number(read(r, 8, (v, o) => v.getBigUint64(o)));
+        case 0xd0 : return read(r, 1, (v, o) => v.getInt8(o));
+        case 0xd1 : return read(r, 2, (v, o) => v.getInt16(o));
+        case 0xd2 : return read(r, 4, (v, o) => v.getInt32(o));
+        case 0xd3 : return Number(read(r, 8, (v, o) => v.getBigInt64(o)));
+        case 0xd9 : return unpack_str(r, uint(r, 1));
+        case 0xda : return unpack_str(r, uint(r, 2));
+        case 0xdb : return unpack_str(r, uint(r, 4));
+        case 0xdc : return unpack_array(r, uint(r, 2));
+        case 0xdd : return unpack_array(r, uint(r, 4));
+        case 0xde : return unpack_map(r, uint(r, 2));
+        case 0xdf : return unpack_map(r, uint(r, 4));
+    }
+
+    throw new SyntaxError(`MessagePack: Unsupported type 0x${type.toString(16)}`);
+}
+
+function unpack_map(r, length) {
+    const map = {};
+
+    for(let i=0; i<length; i++) {
+        const key = unpack(r);
+
+        map[key] = unpack(r);
+    }
+
+    return map;
+}
+
+function unpack_array(r, length) {
+    const array = new Array(length);
+
+    for(let i=0; i<length; i++) {
+        array[i] = unpack(r);
+    }
+
+    return array;
+}
+
+function unpack_str(r, length) {
+    return TEXT_DECODER.decode(unpack_bin(r, length));
+}
+
+function unpack_bin(r, length) {
+    if(r.offset + length > r.data.length) throw new SyntaxError("MessagePack: Truncated data");
+
+    const data = r.data.subarray(r.offset, r.offset + length);
+
+    r.offset += length;
+
+    return data;
+}
+
+function byte(r) {
+    return read(r, 1, (v, o) => v.getUint8(o));
+}
+
+function uint(r, numbytes) {
+    switch(numbytes) {
+        case 1  : return read(r, 1, (v, o) => v.getUint8(o));
+        case 2  : return read(r, 2, (v, o) => v.getUint16(o));
+        default : return read(r, 4, (v, o) => v.getUint32(o));
+    }
+}
+
+function read(r, numbytes, getter) {
+    if(r.offset + numbytes > r.data.length) throw new SyntaxError("MessagePack: Truncated data");
+
+    const value = getter(r.view, r.offset);
+
+    r.offset += numbytes;
+
+    return value;
+}
@@ -10,6 +10,7 @@ export class QueryClient {
     #session = null;
     #queryName = null;
     #queryContent = null;
+    #seq = null;
     #eventManager = event_manager.event_manager();
 
     constructor(session, queryName, queryContent={}) {
@@ -31,9 +32,10 @@ export class QueryClient {
     }
 
     #on_open(event) {
+        /* Resume from the last complete reply, if any, after reconnecting */
         this.#session.send({
             "MESSAGE_TYPE" : this.#queryName,
-            "CONTENT"      : this.#queryContent,
+            "CONTENT"      : this.#seq ? { ...this.#queryContent, "SEQ" : this.#seq } : this.#queryContent,
         });
     }
 
@@ -113,6 +115,9 @@ export class QueryClient {
             });
         }
 
+        /* Only a reply that leaves nothing more to send can be resumed from */
+        this.#seq = content.SEQ ?? null;
+
         /* Request the next batch of data */
         if(content.IS_LAST === false) {
             this.#session.send({
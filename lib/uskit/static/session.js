@@ -1,5 +1,6 @@
 import * as util from "./util.js";
 import * as debug from "./debug.js";
+import * as msgpack from "./msgpack.js";
 import * as event_manager from "./event_manager.js";
 
 
@@ -13,10 +14,12 @@ export class Session {
     #url = null;
     #websocket = null;
     #reconnectMs = 1000;
+    #protocol = "json";
     #eventManager = event_manager.event_manager();
 
     constructor(opts={}) {
         this.#reconnectMs = opts["reconnect-ms"] ?? this.#reconnectMs;
+        this.#protocol = opts["protocol"] ?? this.#protocol;
     }
 
     on(type, handler) {
@@ -37,13 +40,19 @@ export class Session {
     *
     * ... where <location> is the URL of the webserver that is serving this
     * Javascript code, less the protocol part.
+    *
+    * If the session was created with `{"protocol": "msgpack"}`, messages are
+    * exchanged as MessagePack if the server supports it, JSON otherwise.
     */
     open(url) {
         const fullurl = new URL(url, `${location.protocol == "http:" ? "ws" : "wss"}://${location.host}/${location.pathname}`).href
 
         this.close();
         this.#url = url;
-        this.#websocket = new WebSocket(fullurl);
+        this.#websocket = this.#protocol == "msgpack"
+            ? new WebSocket(fullurl, ["uskit.msgpack", "uskit.json"])
+            : new WebSocket(fullurl);
+        this.#websocket.binaryType = "arraybuffer";
 
         this.#websocket.addEventListener("open", (event) => this.#open_handler(event));
         this.#websocket.addEventListener("close", (event) => this.#close_handler(event));
@@ -66,13 +75,19 @@ export class Session {
         };
 
         debug.socket("TX:", messageCopy);
-        this.#websocket.send(JSON.stringify(messageCopy));
+
+        if(this.#websocket.protocol == "uskit.msgpack") {
+            this.#websocket.send(msgpack.encode(messageCopy));
+        }
+        else {
+            this.#websocket.send(JSON.stringify(messageCopy));
+        }
 
         return messageCopy;
     }
 
     #open_handler(event) {
-        debug.info("socket open");
+        debug.info("socket open", this.#websocket.protocol);
 
         this.#eventManager.trigger({
             "type"    : "open",
@@ -96,7 +111,7 @@ export class Session {
         const data = event.data;
 
         try {
-            const message = JSON.parse(data);
+            const message = data instanceof ArrayBuffer ? msgpack.decode(data) : JSON.parse(data);
 
             debug.socket("RX:", message);
 
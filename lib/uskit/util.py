@@ -1,5 +1,6 @@
 import os
 import datetime
+import collections
 import __main__
 
 
@@ -40,3 +41,143 @@ def dictmerge(dict1, dict2):
 
     return dict1
 
+
+
+##############################################################################
+# LRU CACHE
+
+class LruCache:
+    """
+        A dictionary of up to `maxsize` items.  Once full, adding an item
+        evicts the least recently used one.  Lookups are counted so the hit
+        rate can be reported.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        try:
+            value = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.items.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.items.pop(key, default)
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "size"    : len(self.items),
+            "maxsize" : self.maxsize,
+            "hits"    : self.hits,
+            "misses"  : self.misses,
+            "hitRate" : self.hits / lookups if lookups else 0.0,
+        }
+
+
+##############################################################################
+# CHANGE LOG
+
+class ChangeLog:
+    """
+        The last `maxsize` changes, each logged with a sequence number no
+        lower than that of the change before it.  Once full, logging a
+        change drops the oldest one.  All changes numbered after `start`
+        are still in the log.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = collections.deque()
+        self.start = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, seq, change):
+        self.entries.append((seq, change))
+
+        while len(self.entries) > self.maxsize:
+            self.start = self.entries.popleft()[0]
+
+    def since(self, seq):
+        """
+            Return the (seq, change) of each change numbered after `seq`, in
+            the order they were logged, or None if any of them have been
+            dropped.
+        """
+        if seq < self.start:
+            return None
+
+        entries = []
+
+        for entry in reversed(self.entries):
+            if entry[0] <= seq:
+                break
+
+            entries += [entry]
+
+        entries.reverse()
+
+        return entries
+
+    def clear(self, seq):
+        """
+            Drop every change, as if all changes up to `seq` were dropped.
+        """
+        self.entries.clear()
+        self.start = seq
+
+
+##############################################################################
+# JSON
+
+class JsonRecord(dict):
+    """
+        A dictionary whose JSON encoding is computed once and reused every
+        time it is sent, so a record sent to many sessions is only encoded
+        once per codec.  It must not be modified once it has been encoded.
+    """
+    __slots__ = ("encodedByCodec",)
+
+    def encode(self, codec):
+        """
+            Return the JSON encoding of this record as produced by `codec`.
+        """
+        try:
+            return self.encodedByCodec[codec.name]
+        except AttributeError:
+            self.encodedByCodec = {}
+        except KeyError:
+            pass
+
+        encoded = self.encodedByCodec[codec.name] = codec.dumps(self)
+
+        return encoded
@@ -0,0 +1,157 @@
+import os
+import socket
+import asyncio
+import tornado.process
+from . import debug
+from . import json_codec
+from . import event_manager
+
+
+##############################################################################
+# GLOBALS
+
+# The largest message sent to the other workers in one datagram
+MAX_MESSAGE = 65536
+
+# Seconds to wait for a worker to make room for a message before dropping it
+SEND_TIMEOUT = 5
+
+
+##############################################################################
+# PEERS
+
+class Peers:
+    """
+        The channel between the worker processes forked by `workers()`.
+
+        Each worker has a Unix datagram socket pair created before forking.
+        A worker reads the messages sent to it from one end of its own pair,
+        and sends messages to the other workers through the other end of
+        theirs.  Each message is one datagram, so messages from different
+        workers never interleave.  The messages received are triggered as
+        events, in the order they were received, to the handlers of their
+        "type".
+
+        `Peers.current` is the channel of this process if it is a worker.
+    """
+    current = None
+
+    def __init__(self, workerId, socketPairs):
+        self.workerId = workerId
+        self.receiver = socketPairs[workerId][1]
+        self.senders = [pair[0] for i, pair in enumerate(socketPairs) if i != workerId]
+        self.codec = json_codec.json_codec("msgpack" if json_codec.msgpack else "auto")
+        self.eventManager = event_manager.event_manager()
+        self.readTask = None
+
+        # Only keep this worker's end of the other pairs
+        for i, (sender, receiver) in enumerate(socketPairs):
+            if i != workerId:
+                receiver.close()
+            else:
+                sender.close()
+
+    def on(self, type, handler):
+        self.eventManager.on(type, handler)
+
+        # Start reading once there is someone to read for
+        if not self.readTask:
+            self.readTask = asyncio.create_task(self.__read())
+
+    def off(self, type, handler):
+        self.eventManager.off(type, handler)
+
+        if not self.eventManager.handlersByType and self.readTask:
+            self.readTask.cancel()
+            self.readTask = None
+
+    def encode(self, message):
+        """
+            Return a message encoded as a datagram, or None if it is larger
+            than MAX_MESSAGE.
+        """
+        data = self.codec.encode(message)
+
+        if isinstance(data, str):
+            data = data.encode()
+
+        return data if len(data) <= MAX_MESSAGE else None
+
+    async def send(self, data):
+        """
+            Send an encoded message to every other worker.  A worker that has
+            not made room for it within SEND_TIMEOUT seconds, e.g., because
+            it has died, does not get it.
+        """
+        loop = asyncio.get_running_loop()
+
+        for sender in self.senders:
+            try:
+                await asyncio.wait_for(loop.sock_sendall(sender, data), SEND_TIMEOUT)
+
+            except (asyncio.TimeoutError, OSError) as e:
+                debug.error(f"Worker {self.workerId}: Message to a worker dropped", str(e) or "Timed out")
+
+    async def __read(self):
+        """
+            Handle the messages to this worker one at a time.  Messages not
+            yet read wait in the socket, so a worker that falls behind slows
+            down the senders instead of queueing without limit.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            data = await loop.sock_recv(self.receiver, MAX_MESSAGE)
+
+            try:
+                message = self.codec.decode(data)
+
+                await self.eventManager.trigger(message)
+
+            except Exception as e:
+                debug.error(f"Worker {self.workerId}: Error handling a message from a worker", str(e))
+
+
+##############################################################################
+# FACTORY
+
+def workers(count, setup=None, maxRestarts=100):
+    """
+        Fork `count` worker processes and return the ID of the worker, from 0
+        to `count - 1`, in each worker.  Call it before starting the event
+        loop, e.g.:
+
+            uskit.workers(4, setup=create_database)
+            asyncio.run(main())
+
+        `setup`, if given, is a coroutine function run once before forking,
+        e.g., to create and load the database file the workers share.  The
+        original process does not return; it restarts workers that exit with
+        an error, up to `maxRestarts` times, and exits once all workers have
+        exited.  With a count of 1 or less, no process is forked and 0 is
+        returned.
+
+        Each worker's `Server.listen()` listens on the same port with
+        SO_REUSEPORT so the kernel spreads the connections across the
+        workers.  Each worker's `Database` of a file sends the changes it
+        commits to the other workers, whose observers, like query services,
+        are notified of them.
+    """
+    if setup:
+        asyncio.run(setup())
+
+    if count <= 1:
+        return 0
+
+    socketPairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for i in range(count)]
+
+    for pair in socketPairs:
+        for sock in pair:
+            sock.setblocking(False)
+
+    workerId = tornado.process.fork_processes(count, maxRestarts)
+    Peers.current = Peers(workerId, socketPairs)
+
+    debug.info(f"Worker {workerId} of {count} started (pid {os.getpid()})")
+
+    return workerId
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import uskit
+import asyncio
+import tornado.websocket
+from uskit import debug
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+PORT = 8081
+
+
+async def main():
+    debug.set_level("INFO", False)
+    debug.set_level("SOCKET", False)
+
+    db = await uskit.database("./test-db.json", datafiles=["test-db.csv"])
+    server = uskit.server(**{
+        "compression-by-path" : {
+            "/small" : { "min-size" : 100000 },
+            "/large" : { "min-size" : 100 },
+        },
+    })
+    testQuery = uskit.query_service(db, "./test-query.json")
+
+    server.on("/small", lambda event : testQuery.trigger(event))
+    server.on("/large", lambda event : testQuery.trigger(event))
+    server.listen(PORT)
+
+    # Compression is offered until the average message is known ...
+    for i in range(2):
+        stats = await query(server, "/small")
+        print(f"{'/small':8} {i + 1} {stats}")
+
+    assert stats["messages"] == 4
+    assert stats["compressedMessages"] == 2
+
+    # ... and after that only if it is at least min-size
+    for i in range(2):
+        stats = await query(server, "/large")
+        print(f"{'/large':8} {i + 1} {stats}")
+
+    assert stats["averageSize"] >= 100
+    assert stats["messages"] == 4
+    assert stats["compressedMessages"] == 4
+
+    await db.close()
+
+
+async def query(server, path):
+    client = await tornado.websocket.websocket_connect(f"ws://localhost:{PORT}{path}", compression_options={})
+
+    await client.write_message(json.dumps({
+        "MESSAGE_TYPE" : "CHAT_QUERY",
+        "MESSAGE_ID"   : 1,
+    }))
+
+    for i in range(2):
+        await client.read_message()
+
+    client.close()
+
+    return server.compression_stats()[path]
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import uskit
+import asyncio
+
+COUNT = 5000
+
+
+async def main():
+    eventManager = uskit.event_manager()
+    called = []
+
+    async def on_open1(event):
+        called.append("on_open1")
+
+    def on_open2(event):
+        called.append("on_open2")
+
+    eventManager.on("open", on_open1)
+    eventManager.on("open", on_open2)
+
+    count = await eventManager.trigger({
+        "type" : "open",
+    })
+
+    print(f"called {called}")
+
+    assert count == 2
+    assert sorted(called) == ["on_open1", "on_open2"]
+
+    await many()
+
+
+async def many():
+    eventManager = uskit.event_manager(maxConcurrency=100)
+    handlers = [Counter() for i in range(COUNT)]
+
+    for counter in handlers:
+        eventManager.on("change", counter.on_change)
+        eventManager.on("change", counter.on_change_async)
+
+    count = await eventManager.trigger({ "type" : "change" })
+
+    for counter in handlers:
+        eventManager.off("change", counter.on_change)
+        eventManager.off("change", counter.on_change_async)
+
+    print(f"{count} handlers called, at most {Counter.peak} at once")
+
+    assert count == COUNT * 2
+    assert all(counter.count == 2 for counter in handlers)
+    assert Counter.peak <= eventManager.maxConcurrency
+    assert not eventManager.handlersByType
+
+class Counter:
+    running = 0
+    peak = 0
+
+    def __init__(self):
+        self.count = 0
+
+    def on_change(self, event):
+        self.count += 1
+
+    async def on_change_async(self, event):
+        Counter.running += 1
+        Counter.peak = max(Counter.peak, Counter.running)
+        await asyncio.sleep(0)
+        Counter.running -= 1
+        self.count += 1
+
+
+asyncio.run(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uskit
+import asyncio
+import tempfile
+from uskit import debug
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+COUNT = 2000
+
+
+async def main():
+    debug.set_level("INFO", False)
+
+    print(f"Throughput of {COUNT} concurrent inserts into a database file\n")
+    print(f"{'group commit':16} {'ms':>8} {'writes/s':>10}")
+
+    for groupCommitMs in [0, 2, 10]:
+        with tempfile.TemporaryDirectory() as dirname:
+            db = await uskit.database("./test-db.json", dbfile=os.path.join(dirname, "test.db"), groupCommitMs=groupCommitMs)
+
+            start = time.perf_counter()
+
+            await asyncio.gather(*[
+                db.insert("MESSAGE", { "MESSAGE_ID" : i, "USER_ID" : 1, "MESSAGE_TEXT" : f"Message {i}" })
+                for i in range(COUNT)
+            ])
+
+            elapsed = time.perf_counter() - start
+            name = f"{groupCommitMs}ms" if groupCommitMs else "off"
+
+            print(f"{name:16} {elapsed * 1000:8.1f} {COUNT / elapsed:10.0f}")
+
+            assert len([row async for row in db.select("* from MESSAGE")]) == COUNT
+
+            await db.close()
+
+    print()
+
+    await check()
+
+
+async def check():
+    db = await uskit.database("./test-db.json", datafiles=["test-db.csv"], groupCommitMs=50)
+
+    # A writer that gives up waiting for its group commit ...
+    try:
+        await asyncio.wait_for(db.insert("USER", { "USER_ID" : 10, "USER_NAME" : "Mallory" }), 0.01)
+    except asyncio.TimeoutError:
+        pass
+
+    # ... does not stop the next group from committing
+    await asyncio.wait_for(db.insert("USER", { "USER_ID" : 11, "USER_NAME" : "Trent" }), 5)
+    await asyncio.wait_for(db.update("USER", { "USER_ID" : 11, "USER_NAME" : "Trudy" }), 5)
+
+    assert (await db.get("USER", { "USER_ID" : 10 }))["USER_NAME"] == "Mallory"
+    assert (await db.get("USER", { "USER_ID" : 11 }))["USER_NAME"] == "Trudy"
+
+    print("Cancelled group commit waiter: OK")
+
+    await db.close()
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import uskit
+import asyncio
+from uskit import debug
+from uskit.index_advisor import IndexAdvisor
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+
+# Users and their messages, joined on the unindexed MESSAGE.USER_ID
+USER_QUERY = {
+    "queryName" : "USER_QUERY",
+    "joinspec"  : [
+        { "table" : "USER"    , "alias" : "u" },
+        { "table" : "MESSAGE" , "alias" : "m", "joinOn" : "m.USER_ID = u.USER_ID" },
+    ],
+    "fields"    : [
+        { "name" : "f_USER_ID"      , "source" : "u.USER_ID"      , "title" : "User ID"      , "type" : "integer" },
+        { "name" : "f_MESSAGE_TEXT" , "source" : "m.MESSAGE_TEXT" , "title" : "Message Text" , "type" : "text"    },
+    ],
+}
+
+
+async def main():
+    debug.set_level("INFO", False)
+
+    db = await uskit.database("./test-db.json", datafiles=["test-db.csv"])
+
+    with open("test-query.json") as fd:
+        chatQuery = json.load(fd)
+
+    for queryCfg in [chatQuery, USER_QUERY]:
+        advisor = IndexAdvisor(db, queryCfg)
+        findings = await advisor.analyze()
+
+        print(f"{queryCfg['queryName']}:")
+
+        for finding in findings:
+            print(f"    {finding['shape']:14} {finding['step']:50} {finding['index'] or finding['reason']}")
+
+            if finding["index"]:
+                await db.create_index(finding["index"]["table"], finding["index"]["name"], finding["index"]["fields"])
+
+        print()
+
+        # Looking up the messages of a user also looks up those without a
+        # user, for which every message must be read
+        if queryCfg is chatQuery:
+            (finding,) = [f for f in findings if f["shape"] == "lookup USER"]
+
+            assert finding["index"] is None
+            assert finding["reason"] == "rows without u are also looked up, which no index on MESSAGE can find"
+
+    print("USER_QUERY after creating the recommended indexes:")
+
+    for finding in await IndexAdvisor(db, USER_QUERY).analyze():
+        print(f"    {finding['shape']:14} {finding['step']:50} {finding['index'] or finding['reason']}")
+
+    await db.close()
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
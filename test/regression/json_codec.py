@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uskit
+from uskit import util
+from uskit import json_codec
+from uskit.json_codec import orjson
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+ROWCOUNT = 500
+SESSIONS = 100
+COUNT = 20
+
+
+def main():
+    print(f"Encoding {ROWCOUNT} rows for one session, then for {SESSIONS} sessions (best time in microseconds)")
+    print("dumps is the codec's own dumps() of plain dicts, the baseline for one session, and")
+    print(f"fan-out (plain) the baseline for {SESSIONS} sessions, encoding every row for each\n")
+    print(f"{'codec':8} {'dumps':>10} {'encode':>10} {'fan-out (plain)':>16} {'fan-out (shared)':>17} {'decode':>10}")
+
+    for name in ["json", "ujson", "orjson", "msgpack"]:
+        try:
+            codec = json_codec.json_codec(name)
+        except uskit.errors.Error:
+            print(f"{name:8} not installed")
+            continue
+
+        plain = [snapshot([dict(r) for r in rows()]) for i in range(COUNT)]
+        pages = [snapshot(rows()) for i in range(COUNT)]
+        unshared = [dict(r) for r in rows()]
+        shared = rows()
+        encoded = codec.encode(pages[0])
+
+        assert codec.decode(encoded)["CONTENT"] == codec.decode(codec.dumps(plain[0]))["CONTENT"]
+        assert codec.decode(codec.encode(snapshot(shared), True))["CONTENT"] == codec.decode(encoded)["CONTENT"]
+        assert codec.decode(codec.encode(snapshot(shared), True))["CONTENT"] == codec.decode(codec.encode(snapshot(shared), True))["CONTENT"]
+
+        # A placeholder in the message is not mistaken for a row
+        tricky = snapshot(rows()[:2], json_codec.PLACEHOLDER)
+        assert codec.decode(codec.encode(tricky, True)) == codec.decode(codec.dumps(tricky))
+
+        tDumps = bench(lambda i: codec.dumps(plain[i]))
+        tEncode = bench(lambda i: codec.encode(pages[i]))
+        tPlain = bench(lambda i: [codec.encode(snapshot(unshared, f"Q-{j}")) for j in range(SESSIONS)])
+        tShared = bench(lambda i: [codec.encode(snapshot(shared, f"Q-{j}"), True) for j in range(SESSIONS)])
+        tDecode = bench(lambda i: codec.decode(encoded))
+
+        # Without orjson.Fragment, orjson encodes shared messages like any other
+        if name == "orjson" and not json_codec.FRAGMENTS:
+            print(f"{name:8} {tDumps:10.0f} {tEncode:10.0f} {tPlain:16.0f} {'n/a':>17} {tDecode:10.0f}")
+            print(f"{'':8} orjson {orjson.__version__} has no Fragment, so shared rows are encoded per session")
+        else:
+            print(f"{name:8} {tDumps:10.0f} {tEncode:10.0f} {tPlain:16.0f} {tShared:17.0f} {tDecode:10.0f}")
+
+
+def rows():
+    return [json_codec.json_record({
+        "__rowid__"      : f"{i}|{i % 7}",
+        "f_TIMESTAMP"    : "2023-01-01 00:00:00.000000 +0000",
+        "f_MESSAGE_ID"   : i,
+        "f_MESSAGE_TEXT" : f"Message number {i}",
+        "f_USER_ID"      : i % 7,
+        "f_USER_NAME"    : f"User {i % 7}",
+        "f_SCORE"        : i * 1.5,
+    }) for i in range(ROWCOUNT)]
+
+
+def snapshot(rows, queryId="Q-0"):
+    return {
+        "MESSAGE_TYPE" : "CHAT_QUERY_SNAPSHOT",
+        "REPLY_TO_ID"  : 1,
+        "CONTENT"      : {
+            "QUERY_ID" : queryId,
+            "INSERT"   : rows,
+            "IS_LAST"  : True,
+        },
+        "TIMESTAMP"    : util.nowstring(),
+    }
+
+
+def bench(func):
+    best = float("inf")
+
+    for i in range(COUNT):
+        start = time.perf_counter()
+        func(i)
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000000
+
+
+os.chdir(SCRIPTDIR)
+main()
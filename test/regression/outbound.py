@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import os
+import uskit
+import asyncio
+from uskit import debug
+from uskit import session
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+
+
+class WebSocket:
+    """
+        Just enough of a websocket for a session, one that writes slowly or
+        not at all.
+    """
+    def __init__(self, error=None):
+        self.error = error
+        self.messages = []
+
+    def on(self, type, handler):
+        pass
+
+    def close(self):
+        pass
+
+    async def write_message(self, data, binary=False):
+        await asyncio.sleep(0.001)
+
+        if self.error:
+            raise self.error
+
+        self.messages += [data]
+
+
+async def main():
+    debug.set_level("SOCKET", False)
+
+    # Query updates are conflated by default, so they do not wait
+    websocket = WebSocket()
+    sess = session.session(websocket)
+
+    assert sess.policy == "conflate"
+
+    # Senders are blocked until the queue drains, and drain handlers are
+    # called even if they fail
+    sess = session.session(websocket, outbound={ "max-messages" : 4, "policy" : "block" })
+    drains = []
+
+    async def on_drain(event):
+        drains.append(event)
+        await asyncio.sleep(0.01)
+        raise ValueError("Expected drain handler failure")
+
+    sess.on("drain", on_drain)
+
+    for i in range(20):
+        await sess.send({ "MESSAGE_TYPE" : "TEST", "CONTENT" : i })
+
+    await asyncio.sleep(0.1)
+
+    print(f"Sent {len(websocket.messages)} messages, drained {len(drains)} times")
+
+    assert len(websocket.messages) == 20
+    assert drains
+    assert not sess.drainTasks
+
+    # A failed write closes the session, and the next send says why
+    websocket = WebSocket(OSError("Broken pipe"))
+    sess = session.session(websocket)
+
+    await sess.send({ "MESSAGE_TYPE" : "TEST" })
+    await asyncio.sleep(0.1)
+
+    try:
+        await sess.send({ "MESSAGE_TYPE" : "TEST" })
+        assert False
+    except uskit.errors.SessionClosedError as e:
+        print(f"Failed write: {e}")
+        assert "Broken pipe" in str(e)
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
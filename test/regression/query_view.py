@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import uskit
+import asyncio
+from uskit import debug
+from uskit.query_view import QueryView
+from uskit.query_service import QueryData
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+
+
+async def main():
+    debug.set_level("INFO", False)
+    debug.set_level("WARNING", False)
+
+    with open("test-query.json") as fd:
+        queryCfg = json.load(fd)
+
+    # Joins that SQLite and Python compare differently are not supported
+    joinspec = queryCfg["joinspec"]
+    mixed = [joinspec[0], joinspec[1] | { "joinOn" : "u.USER_NAME = m.USER_ID" }]
+
+    for name, joins, typesByField, isSupported in [
+        ("same affinity" , joinspec, { "USER_ID" : "integer" }                       , True ),
+        ("binary"        , joinspec, { "USER_ID" : "text collate binary" }           , True ),
+        ("nocase"        , joinspec, { "USER_ID" : "text collate nocase" }           , False),
+        ("undeclared"    , joinspec, {}                                              , False),
+        ("mixed affinity", mixed   , { "USER_ID" : "integer", "USER_NAME" : "text" } , False),
+    ]:
+        supported = QueryView.supports(joins, queryCfg["fields"], typesByField)
+
+        print(f"{name:16} {'supported' if supported else 'not supported'}")
+
+        assert supported == isSupported
+
+    # The same changes are notified with or without a view, and a view too
+    # large to load falls back to the database
+    expected = None
+
+    for name, overrides, isView in [
+        ("database"   , {}                                                   , False),
+        ("view"       , { "incremental" : True }                             , True ),
+        ("view (full)", { "incremental" : True, "incrementalMaxRecords" : 3 }, False),
+    ]:
+        db = await uskit.database("./test-db.json", datafiles=["test-db.csv"])
+        data = QueryData(db, queryCfg | overrides)
+        changes = []
+
+        async def on_changes(event):
+            changes.extend((change["operation"], change["row"]["__rowid__"], change["row"]["f_USER_NAME"]) for change in event["changes"])
+
+        data.on("changes", on_changes)
+
+        await db.insert("MESSAGE", { "MESSAGE_ID" : 5, "USER_ID" : 3, "MESSAGE_TEXT" : "Bye!" })
+        await db.update("USER", { "USER_ID" : 2, "USER_NAME" : "Alicia" })
+        await db.delete("MESSAGE", { "MESSAGE_ID" : 1 })
+
+        print(f"{name:16} {len(changes)} changes, {'view' if data.view else 'database'}")
+
+        assert changes == (expected or changes)
+        assert (data.view is not None) == isView
+
+        expected = changes
+        await db.close()
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uskit
+import asyncio
+from uskit import debug
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+COUNT = 10000
+USERS = [1, 2, 3, 4]
+
+
+async def main():
+    debug.set_level("INFO", False)
+
+    print(f"Time to get {COUNT} users by key (milliseconds)\n")
+    print(f"{'record cache':16} {'get':>8} {'hits':>8} {'misses':>8}")
+
+    for size in [0, 1024]:
+        db = await uskit.database("./test-db.json", datafiles=["test-db.csv"], recordCacheSize=size)
+
+        start = time.perf_counter()
+
+        for i in range(COUNT):
+            await db.get("USER", { "USER_ID" : USERS[i % len(USERS)] })
+
+        elapsed = (time.perf_counter() - start) * 1000
+        stats = db.record_cache_stats()
+        name = f"{size} records" if size else "off"
+
+        print(f"{name:16} {elapsed:8.1f} {stats['hits']:8} {stats['misses']:8}")
+
+        if size:
+            await check(db)
+
+        await db.close()
+
+
+async def check(db):
+    user = await db.get("USER", { "USER_ID" : 2 })
+
+    # Changes are seen by cached records
+    await db.update("USER", { "USER_ID" : 2, "USER_NAME" : "Alice Cooper" })
+    assert (await db.get("USER", { "USER_ID" : 2 }))["USER_NAME"] == "Alice Cooper"
+    assert user["USER_NAME"] == "Alice Cooper"
+
+    # Deleted records are no longer cached
+    await db.delete("USER", { "USER_ID" : 2 })
+    assert await db.get("USER", { "USER_ID" : 2 }) == {}
+
+    # Rolled back changes are not
+    try:
+        await db.transact([
+            { "table" : "USER", "operation" : "update", "record" : { "USER_ID" : 3, "USER_NAME" : "Robert" } },
+            { "table" : "USER", "operation" : "insert", "record" : { "USER_ID" : 4, "USER_NAME" : "Eve" } },
+        ])
+    except uskit.errors.DatabaseIntegrityError:
+        pass
+
+    assert (await db.get("USER", { "USER_ID" : 3 }))["USER_NAME"] == "Bob"
+
+    # Lookups by other fields still select
+    assert (await db.get("USER", { "USER_NAME" : "Eve" }))["USER_ID"] == 4
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
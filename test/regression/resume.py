@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import uskit
+import asyncio
+import tempfile
+from uskit import debug
+from tornado.websocket import websocket_connect
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+PORT = 8090
+CHANGE_LOG_SIZE = 10
+
+
+class Client:
+    """
+        A query client that keeps the result rows and the last SEQ, like the
+        JavaScript query client.
+    """
+
+    def __init__(self, queryName):
+        self.queryName = queryName
+        self.rowsByRowId = {}
+        self.messages = []
+        self.seq = None
+        self.conn = None
+
+    async def query(self, content={}):
+        self.conn = await websocket_connect(f"ws://localhost:{PORT}/regression")
+        self.messages = []
+
+        await self.conn.write_message(json.dumps({
+            "MESSAGE_TYPE" : self.queryName,
+            "MESSAGE_ID"   : 1,
+            "CONTENT"      : content,
+        }))
+
+        await self.read()
+
+    async def read(self):
+        # Read until the client has every row
+        while not self.messages or not self.messages[-1]["CONTENT"].get("IS_LAST"):
+            message = json.loads(await asyncio.wait_for(self.conn.read_message(), 5))
+            content = message["CONTENT"]
+
+            if "SCHEMA" in content:
+                self.rowsByRowId = {}
+
+            for row in content.get("INSERT", []) + content.get("UPDATE", []):
+                self.rowsByRowId[row["__rowid__"]] = row
+
+            for row in content.get("DELETE", []):
+                self.rowsByRowId.pop(row["__rowid__"], None)
+
+            self.seq = content.get("SEQ")
+            self.messages += [message]
+
+    async def resume(self):
+        await self.query({ "SEQ" : self.seq })
+
+    def close(self):
+        self.conn.close()
+
+    def is_resumed(self):
+        return "SCHEMA" not in self.messages[0]["CONTENT"] and not any(m["MESSAGE_TYPE"].endswith("_SNAPSHOT") for m in self.messages)
+
+
+async def main():
+    debug.set_level("INFO", False)
+    debug.set_level("SOCKET", False)
+
+    with open("test-query.json") as fd:
+        queryCfg = json.load(fd)
+
+    # A short change log, so it is easy to overflow
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fd:
+        json.dump({ **queryCfg, "changeLogSize" : CHANGE_LOG_SIZE }, fd)
+
+    db = await uskit.database("./test-db.json", datafiles=["test-db.csv"])
+    server = uskit.server()
+    testQuery = uskit.query_service(db, fd.name)
+    query = uskit.Query(db, queryCfg["joinspec"], queryCfg["fields"])
+    client = Client(queryCfg["queryName"])
+
+    server.on("/regression", lambda event : testQuery.trigger(event))
+    server.listen(PORT)
+
+    # Snapshot
+    await client.query()
+    await check(query, client, "SNAPSHOT", isResumed=False)
+
+    # Resume after an insert, update, and delete
+    client.close()
+    await db.insert("MESSAGE", { "MESSAGE_ID" : 5, "USER_ID" : 3, "MESSAGE_TEXT" : "Bye!" })
+    await db.update("USER", { "USER_ID" : 2, "USER_NAME" : "Alicia" })
+    await db.delete("MESSAGE", { "MESSAGE_ID" : 1 })
+    await client.resume()
+    await check(query, client, "RESUME", isResumed=True)
+
+    # Resume with nothing changed
+    client.close()
+    await client.resume()
+    await check(query, client, "RESUME UNCHANGED", isResumed=True)
+
+    # More changes than the change log holds
+    client.close()
+
+    for i in range(CHANGE_LOG_SIZE + 1):
+        await db.insert("MESSAGE", { "MESSAGE_ID" : 100 + i, "USER_ID" : 4, "MESSAGE_TEXT" : f"Message {i}" })
+
+    await client.resume()
+    await check(query, client, "OVERFLOW", isResumed=False)
+
+    # SEQ of another database, e.g., another worker's
+    client.close()
+    client.seq = "00000000:" + client.seq.split(":")[1]
+    await client.resume()
+    await check(query, client, "FOREIGN SEQ", isResumed=False)
+
+    # Reloaded table
+    client.close()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as csvfd:
+        csvfd.write('MESSAGE.MESSAGE_ID.i,MESSAGE.USER_ID.i,MESSAGE.MESSAGE_TEXT.s\n200,2,"Reloaded"\n')
+
+    await db.load(csvfd.name, events=False)
+    await client.resume()
+    await check(query, client, "RELOAD", isResumed=False)
+
+    # Table reloaded in part, until a chunk fails
+    client.close()
+
+    with open(csvfd.name, "w") as fd2:
+        fd2.write('MESSAGE.MESSAGE_ID.i,MESSAGE.USER_ID.i,MESSAGE.MESSAGE_TEXT.s\n201,2,"Loaded"\n200,2,"Duplicate"\n')
+
+    try:
+        await db.load(csvfd.name, chunkSize=1, events=False)
+    except uskit.errors.DatabaseIntegrityError:
+        pass
+
+    await client.resume()
+    await check(query, client, "PARTIAL RELOAD", isResumed=False)
+
+    # Table reloaded while the client is connected
+    with open(csvfd.name, "w") as fd2:
+        fd2.write('MESSAGE.MESSAGE_ID.i,MESSAGE.USER_ID.i,MESSAGE.MESSAGE_TEXT.s\n202,3,"Loaded live"\n')
+
+    client.messages = []
+    await db.load(csvfd.name, events=False)
+    await client.read()
+    await check(query, client, "LIVE RELOAD", isResumed=False)
+
+    client.close()
+    await db.close()
+
+    os.remove(fd.name)
+    os.remove(csvfd.name)
+
+
+async def check(query, client, name, isResumed):
+    rowsByRowId = {}
+
+    async for row in query():
+        rowsByRowId[row["__rowid__"]] = dict(row)
+
+    print(f"{name:20} {'resumed' if client.is_resumed() else 'snapshot':8} {len(client.messages):4} messages {len(client.rowsByRowId):4} rows")
+
+    assert client.is_resumed() == isResumed
+    assert client.rowsByRowId == rowsByRowId
+    assert client.seq is not None
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
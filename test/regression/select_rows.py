@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uskit
+import asyncio
+import aiosqlite
+import tracemalloc
+from uskit import debug
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+ROWCOUNT = 100000
+
+
+async def main():
+    debug.set_level("INFO", False)
+
+    db = await uskit.database("./test-db.json")
+
+    await db.transact([{
+        "table"     : "MESSAGE",
+        "operation" : "insert",
+        "record"    : { "MESSAGE_ID" : i, "USER_ID" : i % 7, "MESSAGE_TEXT" : f"Message number {i}" },
+    } for i in range(ROWCOUNT)])
+
+    print(f"Selecting {ROWCOUNT} rows and keeping them in memory\n")
+    print(f"{'rows':16} {'time (ms)':>10} {'memory (MB)':>12}")
+
+    # Previous select(): a dict copy of every row
+    async def dicts():
+        async with db.dbconn.execute("select * from MESSAGE") as cursor:
+            cursor.row_factory = aiosqlite.Row
+
+            async for row in cursor:
+                rowAsDict = {}
+
+                for name in row.keys():
+                    rowAsDict[name] = row[name]
+
+                yield rowAsDict
+
+    (tDict, mDict) = await bench(dicts)
+    (tSelect, mSelect) = await bench(lambda: db.select("* from MESSAGE"))
+
+    print(f"{'dict copy':16} {tDict:10.0f} {mDict:12.1f}")
+    print(f"{'select()':16} {tSelect:10.0f} {mSelect:12.1f}")
+
+    await db.close()
+
+
+async def bench(select):
+    # Time
+    start = time.perf_counter()
+    rows = [row async for row in select()]
+    elapsed = time.perf_counter() - start
+    rows = None
+
+    # Memory
+    tracemalloc.start()
+    rows = [row async for row in select()]
+    (size, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(rows) == ROWCOUNT
+
+    return (elapsed * 1000, size / 1024 / 1024)
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
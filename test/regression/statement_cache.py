@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uskit
+import asyncio
+from uskit import debug
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+COUNT = 2000
+ROUNDS = 5
+
+
+async def main():
+    debug.set_level("INFO", False)
+
+    db = await uskit.database("./test-db.json")
+    compile = db._Database__compile
+    shapes = [
+        ("insert", ("MESSAGE_ID", "USER_ID", "MESSAGE_TEXT", "TIMESTAMP")),
+        ("update", ("MESSAGE_ID", "MESSAGE_TEXT", "TIMESTAMP")),
+        ("get"   , ("MESSAGE_ID",)),
+        ("delete", ("MESSAGE_ID",)),
+    ]
+    cache = { (op, "MESSAGE", names) : compile(op, "MESSAGE", names) for (op, names) in shapes }
+    best = [[float("inf")] * 3 for shape in shapes]
+
+    # Before: the SQL of every operation is built from its shape.  After: it
+    # would be looked up in a cache of statements by shape instead.
+    for r in range(ROUNDS):
+        totals = [
+            await bench(lambda i: db.insert("MESSAGE", { "MESSAGE_ID" : i, "USER_ID" : 2, "MESSAGE_TEXT" : f"Message {i}" })),
+            await bench(lambda i: db.update("MESSAGE", { "MESSAGE_ID" : i, "MESSAGE_TEXT" : f"Updated {i}" })),
+            await bench(lambda i: db.get("MESSAGE", { "MESSAGE_ID" : i })),
+            await bench(lambda i: db.delete("MESSAGE", { "MESSAGE_ID" : i })),
+        ]
+
+        for (j, (op, names)) in enumerate(shapes):
+            key = (op, "MESSAGE", names)
+            times = [
+                totals[j],
+                await bench(lambda i: compile(op, "MESSAGE", names)),
+                await bench(lambda i: cache.get(key)),
+            ]
+            best[j] = [min(b, t) for (b, t) in zip(best[j], times)]
+
+    print(f"Best average time over {ROUNDS} rounds of {COUNT} operations (microseconds)\n")
+    print(f"{'operation':10} {'total':>8} {'build':>8} {'lookup':>8} {'saved':>8}")
+
+    for ((op, names), (total, build, lookup)) in zip(shapes, best):
+        print(f"{op:10} {total:8.1f} {build:8.2f} {lookup:8.2f} {(build - lookup) / total * 100:7.1f}%")
+
+    await db.close()
+
+
+async def bench(func):
+    start = time.perf_counter()
+
+    for i in range(COUNT):
+        result = func(i)
+
+        if asyncio.iscoroutine(result):
+            await result
+
+    return (time.perf_counter() - start) / COUNT * 1000000
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
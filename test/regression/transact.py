@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uskit
+import asyncio
+from uskit import debug
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+COUNT = 1000
+ROUNDS = 5
+
+
+async def main():
+    debug.set_level("INFO", False)
+
+    print(f"Best time to transact {COUNT} records over {ROUNDS} rounds (milliseconds)\n")
+    print(f"{'records':16} {'insert':>8} {'update':>8} {'delete':>8} {'events':>8}")
+
+    eventsByName = {}
+
+    # Alternating the field order keeps consecutive records from being batched
+    for name, isBatched in [("one at a time", False), ("batched", True)]:
+        db = await uskit.database("./test-db.json")
+        events = []
+        best = [float("inf")] * 3
+
+        async def observe(event):
+            events.append((event["type"], event["txnId"], event.get("rowId")))
+
+        for op in ["preinsert", "insert", "preupdate", "update", "predelete", "delete"]:
+            db.on(op, "MESSAGE", observe)
+
+        for r in range(ROUNDS):
+            events.clear()
+
+            times = [
+                await bench(db, isBatched, "insert", lambda i: { "MESSAGE_ID" : i, "USER_ID" : 2, "MESSAGE_TEXT" : f"Message {i}" }),
+                await bench(db, isBatched, "update", lambda i: { "MESSAGE_ID" : i, "MESSAGE_TEXT" : f"Updated {i}" }),
+                await bench(db, isBatched, "delete", lambda i: { "MESSAGE_ID" : i }),
+            ]
+            best = [min(b, t) for (b, t) in zip(best, times)]
+
+        print(f"{name:16} {best[0]:8.1f} {best[1]:8.1f} {best[2]:8.1f} {len(events):8}")
+        eventsByName[name] = sorted(events, key=str)
+
+        await db.close()
+
+    # Batches trigger the same events, only in a different order
+    assert eventsByName["one at a time"] == eventsByName["batched"]
+
+
+async def bench(db, isBatched, operation, record):
+    txns = []
+
+    for i in range(COUNT):
+        fields = record(i)
+
+        if not isBatched and i % 2:
+            fields = dict(reversed(fields.items()))
+
+        txns += [{
+            "table"     : "MESSAGE",
+            "operation" : operation,
+            "record"    : fields,
+        }]
+
+    # The last record does not exist
+    if operation != "insert":
+        txns += [{ "table" : "MESSAGE", "operation" : operation, "record" : record(COUNT + 1) }]
+
+    start = time.perf_counter()
+    reply = await db.transact(txns)
+    elapsed = time.perf_counter() - start
+
+    assert reply == [True] * COUNT + [False] * (len(txns) - COUNT), reply
+
+    return elapsed * 1000
+
+
+os.chdir(SCRIPTDIR)
+asyncio.run(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import os
+import atexit
+import uskit
+import asyncio
+import tempfile
+
+SCRIPTPATH = os.path.abspath(__file__)
+SCRIPTDIR = os.path.dirname(SCRIPTPATH)
+WORKERS = 4
+TIMEOUT = 10
+PARENT = os.getpid()
+DBFILE = os.path.join(tempfile.gettempdir(), f"uskit-workers-{PARENT}.db")
+
+
+async def setup():
+    # Create the database file in WAL mode, which the workers share
+    db = await uskit.database("./test-db.json", dbfile=DBFILE, datafiles=["test-db.csv"], readers=1)
+    await db.close()
+
+
+async def main(workerId):
+    db = await uskit.database("./test-db.json", dbfile=DBFILE, readers=2)
+    messageIds = set()
+    received = asyncio.Event()
+
+    # The inserts of the other workers arrive as remote events
+    def on_insert(event):
+        if event.get("remote"):
+            messageIds.add(event["record"]["MESSAGE_ID"])
+
+            if len(messageIds) == WORKERS - 1:
+                received.set()
+
+    db.on("insert", "MESSAGE", on_insert)
+
+    try:
+        await db.insert("MESSAGE", { "MESSAGE_ID" : 100 + workerId, "USER_ID" : 2, "MESSAGE_TEXT" : f"From worker {workerId}" })
+        await asyncio.wait_for(received.wait(), TIMEOUT)
+
+        assert messageIds == { 100 + i for i in range(WORKERS) if i != workerId }
+
+        # Every worker's insert is in the shared file
+        for i in range(WORKERS):
+            assert (await db.get("MESSAGE", { "MESSAGE_ID" : 100 + i }))["MESSAGE_TEXT"] == f"From worker {i}"
+
+        print(f"Worker {workerId}: received {sorted(messageIds)}", flush=True)
+
+    finally:
+        await db.close()
+
+
+def cleanup():
+    if os.getpid() == PARENT:
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(DBFILE + suffix):
+                os.remove(DBFILE + suffix)
+
+
+os.chdir(SCRIPTDIR)
+atexit.register(cleanup)
+
+# A worker that fails is not restarted, so the script fails
+workerId = uskit.workers(WORKERS, setup=setup, maxRestarts=0)
+asyncio.run(main(workerId))